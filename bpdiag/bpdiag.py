@@ -83,9 +83,22 @@ __license__ = 'GNU General Public License v3 or above - '\
 
 import sys
 import argparse
+import array
+import bisect
+import collections
+import datetime
+import glob
+import io
 import json
 import itertools
+import math
+import operator
+import os
+import random
 import re
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
 
 try:
   import pygal
@@ -107,6 +120,8 @@ RETURN_CODES = {
   'error_argument_parser': 1,
   'error_input_nothing_found': 2,
   'error_input_parsing': 3,
+  'error_storage': 4,
+  'error_output': 5,
   'error_env_missing_library': 10
 }
 
@@ -115,24 +130,63 @@ PARSERS = {
     'func': 'parse_plaintext',
     'args': (
       'align_lines', 'keep_empty_lines',
-      'entries', 'skip', 'separator', 'delimiter', 'check'
+      'entries', 'skip', 'separator', 'delimiter', 'check', 'errors',
+      'criteria', 'repeats', 'provenance', 'head', 'sample'
     )
   },
   'json': {
     'func': 'parse_json',
-    'args': ('as_obj', 'check'),
+    'args': (
+      'as_obj', 'check', 'errors', 'criteria', 'repeats', 'head', 'sample'
+    ),
   },
   'regex': {
     'func': 'parse_regex',
-    'args': ('check', ),
+    'args': (
+      'regex', 'check', 'errors', 'criteria', 'repeats', 'provenance',
+      'timestamps', 'head', 'sample'
+    ),
     'def_regex': ur'\b((?P<date>\d{4}-\d{1,2}-\d{1,2})\s+)?((?P<time>\d{1,2}:\d{1,2})\s+)?(?P<sys>\d{2,3})\s*([-+.:,:\/])\s*(?P<dia>\d{2,3})\s*\6\s*(?P<pulse>\d{2,3})\b'
   },
   'csv': {
     'func': 'parse_csv',
-    'args': tuple(),
+    'args': (
+      'columns', 'delimiter', 'check', 'errors', 'criteria', 'repeats',
+      'provenance', 'timestamps', 'head', 'sample', 'position'
+    ),
+  },
+  'sqlite': {
+    'func': 'parse_sqlite',
+    'args': ('filenames', 'criteria', 'repeats', 'head', 'sample'),
   },
 }
 
+COMMANDS = {
+  'merge': 'main_merge',
+  'ingest': 'main_ingest',
+  'query': 'main_query',
+}
+
+STAT_FIELDS = ('sys', 'dia', 'pulse')
+
+DERIVED_FIELDS = ('pp', 'map')
+
+PARTIAL_VERSION = 2
+PARTIAL_KEYS = ('count', 'sum', 'min', 'max', 'm2')
+
+CSV_FIELDS = ('sys', 'dia', 'pulse', 'date', 'time')
+
+DEDUPE_KEYS = ('date', 'time', 'sys', 'dia', 'pulse')
+
+JSON_OUTPUTS = ('json', 'json-obj', 'json-stats', 'json-partial')
+
+BUCKETS = {'day': '%Y-%m-%d', 'week': '%Y-%W', 'month': '%Y-%m', 'year': '%Y'}
+
+DATE_CACHE = {}
+TIME_CACHE = {}
+DATE_STRINGS = {}
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
 
 class BpdiagError(Exception):
   pass
@@ -173,34 +227,115 @@ class Measurement(object):
     return "{0.sys:3}/{0.dia:3}/{0.pulse:3}".format(self)
 
 
+class AlignedData(object):
+
+  """
+  Holds readings grouped by input line (see :func:`parse_plaintext`).
+
+  The readings (:cls:`Measurement` instances or ``None`` values) of all lines
+  are stored in the flat **values** list. The integer array **offsets** marks
+  where each line starts: line *i* is ``values[offsets[i]:offsets[i + 1]]``
+  (the last entry is the length of *values*). So the flat list is available
+  without copying and each line can be accessed directly.
+
+  Iterating over an instance yields the lines as lists. *lines* is an optional
+  iterable of such lists to start with.
+
+  """
+
+  def __init__(self, lines=()):
+    self.values = []
+    self.offsets = array.array('i', [0])
+    for line in lines:
+      self.append(line)
+
+  def append(self, line):
+    """Add the readings from the list *line* as a new line."""
+    self.values.extend(line)
+    self.offsets.append(len(self.values))
+
+  def split(self, values):
+    """
+    Return an iterator over the lines of *values*: a list parallel to the
+    **values** attribute (eg. the readings converted for output).
+
+    """
+    return (
+      values[start:end]
+      for start, end in itertools.izip(self.offsets, self.offsets[1:])
+    )
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("line index out of range")
+    return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+  def __iter__(self):
+    return self.split(self.values)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+
 class Statistic(object):
 
   """
   Collects and calculates statistics from *data*.
 
-  *data* needs to be a list of :cls:`Measurement` instances.
+  *data* needs to be a list of :cls:`Measurement` instances (or an
+  :cls:`AlignedData` instance; a list of such lists is converted to one).
+  *timestamps* is the :cls:`Timestamps` instance of *data*, if the parser
+  recorded one.
 
   The main attributes are the following three lists: **sys** (all systolic
   values), **dia** (all diastolic values) and **pulse** (all pulse values).
   All three in the order of the measures in *data*.
 
   For each list (sys, dia, pulse) there are attributes for the min, max and
-  avarage values: sys_min, sys_max, sys_avg, dia_min, dia_max, etc.
+  avarage values: sys_min, sys_max, sys_avg, dia_min, dia_max, etc. And for
+  the variability: the (sample) standard deviation (sys_std, etc.) and the
+  coefficient of variation in percent (sys_cv, etc.).
+
+  The same attributes exist for two derived lists: **pp** (pulse pressure,
+  SYS - DIA) and **map** (mean arterial pressure, DIA + PP / 3).
+
+  The **index** attribute holds a :cls:`TimeIndex` over the measurements
+  (build on first access). With :meth:`evaluate_rolling` rolling statistics
+  over a time window can be calculated from it. And :meth:`evaluate_groups`
+  calculates statistics per file, line or attribute.
+
+  The statistics are calculated from *totals* (count, sum, min, max and the
+  sum of squared differences from the mean per list). Those can be exported
+  with :meth:`as_partial` and merged into another instance with
+  :meth:`update`, so statistics gathered from several shards of data can be
+  combined without the raw data.
 
   """
 
-  def __init__(self, data):
+  def __init__(self, data, timestamps=None):
+    if isinstance(data, list) and data and isinstance(data[0], list):
+      data = AlignedData(data)
     self.data = data
+    self.timestamps = timestamps
     self.evaluate_data()
 
+  @classmethod
+  def from_partial(cls, partial):
+    """Return a new instance (without *data*) build from *partial*."""
+    stats = cls([])
+    stats.update(partial)
+    return stats
+
   @property
   def is_list(self):
-    return isinstance(self.data[0], list)
+    return isinstance(self.data, AlignedData)
 
   @property
   def values(self):
     if self.is_list:
-      return list(itertools.chain.from_iterable(self.data))
+      return self.data.values
     else:
       return self.data
 
@@ -210,53 +345,1205 @@ class Statistic(object):
 
   @property
   def skipped(self):
-    return len(self) - len(self.measurements)
+    return self._skipped
+
+  @property
+  def index(self):
+    if self._index is None:
+      self._index = TimeIndex(self.values, self.timestamps)
+    return self._index
 
   def evaluate_data(self):
-    """Build sys / dia / pulse list."""
-    self.sys, self.dia, self.pulse = [], [], []
+    """
+    Build the sys / dia / pulse / pp / map lists and collect the totals in one
+    pass, then calculate the statistics.
+
+    The variance is collected with Welford's online algorithm (a running mean
+    and the sum of squared differences from it, *m2*), which is numerically
+    stable.
+
+    """
+    fields = STAT_FIELDS + DERIVED_FIELDS
+    lists = [[] for attr in fields]
+    totals = [[0, 0, None, None, 0.0] for attr in fields]
+    means = [0.0] * len(fields)
     for measure in self.values:
-      self.sys.append(getattr(measure, 'sys', None))
-      self.dia.append(getattr(measure, 'dia', None))
-      self.pulse.append(getattr(measure, 'pulse', None))
-    # calculate statistics
-    for attr, values in (
-      ('sys', self.sys), ('dia', self.dia), ('pulse', self.pulse)
+      if measure is None:
+        for values in lists:
+          values.append(None)
+        continue
+      systolic, diastolic = measure.sys, measure.dia
+      pp = systolic - diastolic
+      for i, value in enumerate(
+        (systolic, diastolic, measure.pulse, pp, diastolic + pp / 3.0)
+      ):
+        lists[i].append(value)
+        t = totals[i]
+        t[0] += 1
+        t[1] += value
+        if t[2] is None or value < t[2]:
+          t[2] = value
+        if t[3] is None or value > t[3]:
+          t[3] = value
+        delta = value - means[i]
+        means[i] += delta / t[0]
+        t[4] += delta * (value - means[i])
+    for attr, values in zip(fields, lists):
+      setattr(self, attr, values)
+    self._count = len(self.sys)
+    self._skipped = self.sys.count(None)
+    self._index = None
+    self._totals = dict(zip(fields, totals))
+    self.evaluate_totals()
+
+  def evaluate_totals(self):
+    """
+    Calculate the min / max / avg / std / cv attributes from the collected
+    totals.
+
+    """
+    for attr in STAT_FIELDS + DERIVED_FIELDS:
+      count, total, low, high, m2 = self._totals[attr]
+      setattr(self, attr + '_min', low)
+      setattr(self, attr + '_max', high)
+      setattr(self, attr + '_avg', total / count if count else None)
+      std = math.sqrt(m2 / (count - 1)) if count > 1 else None
+      setattr(self, attr + '_std', std)
+      if std is not None and total:
+        setattr(self, attr + '_cv', 100.0 * std * count / total)
+      else:
+        setattr(self, attr + '_cv', None)
+
+  def evaluate_rolling(self, days):
+    """
+    Calculate rolling min / max / avg values over a window of *days* for the
+    sys / dia / pulse lists.
+
+    The results are stored in the **rolling** dictionary: the *window* key
+    holds *days*, keys like *sys_min* or *pulse_avg* hold lists parallel to
+    the sys / dia / pulse lists (with ``None`` for measurements without date).
+
+    """
+    self.rolling = {'window': days}
+    for attr in STAT_FIELDS:
+      mins, maxs, avgs = self.index.rolling(getattr(self, attr), days * 86400)
+      self.rolling[attr + '_min'] = mins
+      self.rolling[attr + '_max'] = maxs
+      self.rolling[attr + '_avg'] = avgs
+
+  def evaluate_groups(self, key, provenance=None):
+    """
+    Calculate count / min / max / avg values of the sys / dia / pulse lists
+    per group, in one pass over the data.
+
+    With *key* ``'file'`` the readings are grouped by their file, with
+    ``'line'`` by their line: the index of the line for aligned data (see
+    :func:`parse_plaintext`), the location otherwise. Both need the
+    :cls:`Provenance` instance *provenance* of the data (for aligned data
+    ``'line'`` doesn't). Any other *key* names the attribute to group by (eg.
+    one captured by the *regex* parser); readings without it are grouped under
+    ``None``. Dates and times recorded by :cls:`Timestamps` are grouped by
+    their integer timestamp.
+
+    The results are stored in the **groups** dictionary (in order of first
+    appearance): for each group a dictionary with the *count* of readings, the
+    number of *skipped* ones and keys like *sys_min* or *pulse_avg*.
+
+    """
+    if key in ('file', 'line') and provenance is None and not (
+      key == 'line' and self.is_list
     ):
-      values = filter(None, values)
-      if values:
-        setattr(self, attr + '_min', min(values))
-        setattr(self, attr + '_max', max(values))
-        setattr(self, attr + '_avg', sum(values) / len(values))
+      raise BpdiagError(
+        "grouping by {} needs the position of the readings (not recorded "
+        "by the json and sqlite parsers)".format(key)
+      )
+    if self.is_list:
+      lines = ((i, m) for i, l in enumerate(self.data, 1) for m in l)
+    else:
+      lines = ((None, m) for m in self.data)
+    # the kind of timestamp needed to group by it
+    packed = {'date': 1, 'time': 2}.get(key) if self.timestamps else None
+    names = {}
+    totals = collections.OrderedDict()
+    for i, (line, measure) in enumerate(lines):
+      if key == 'file':
+        group = provenance.filename(i)
+      elif key == 'line':
+        group = line if line is not None else provenance.location(i)
+      elif measure is None:
+        continue
+      elif packed and self.timestamps.kinds[i] >= packed:
+        stamp = self.timestamps.stamps[i]
+        value = stamp // 86400 if key == 'date' else stamp % 86400
+        # the string is only build once per group
+        group = names.get(value)
+        if group is None:
+          group = names[value] = (
+            format_date(stamp) if key == 'date' else format_time(stamp)
+          )
       else:
-        for ending in ('_min', '_max', '_avg'):
-          setattr(self, attr + ending, None)
-
-  def as_dict(self):
+        group = getattr(measure, key, None)
+      if group not in totals:
+        totals[group] = [0, 0] + [[0, None, None] for attr in STAT_FIELDS]
+      t = totals[group]
+      if measure is None:
+        t[1] += 1
+        continue
+      t[0] += 1
+      for value, field in zip(measure.as_tuple(), t[2:]):
+        field[0] += value
+        if field[1] is None or value < field[1]:
+          field[1] = value
+        if field[2] is None or value > field[2]:
+          field[2] = value
+    self.groups = collections.OrderedDict()
+    for group, t in totals.items():
+      stats = self.groups[group] = {'count': t[0], 'skipped': t[1]}
+      for attr, (total, low, high) in zip(STAT_FIELDS, t[2:]):
+        stats[attr + '_min'] = low
+        stats[attr + '_max'] = high
+        stats[attr + '_avg'] = total / t[0] if t[0] else None
+
+  def update(self, partial):
+    """
+    Merge the partial statistic *partial* (see :meth:`as_partial`) into this
+    instance and recalculate the statistics.
+
+    Only the statistics are updated, *data* and the sys / dia / pulse lists
+    stay untouched.
+
+    """
+    try:
+      if partial['partial'] != PARTIAL_VERSION:
+        raise BpdiagError(
+          "unsupported partial statistic version: '{}'".format(
+            partial['partial']
+          )
+        )
+      count, skipped = partial['count'], partial['skipped']
+      parts = {
+        attr: [partial[attr][key] for key in PARTIAL_KEYS]
+        for attr in STAT_FIELDS + DERIVED_FIELDS
+      }
+    except (KeyError, TypeError) as e:
+      raise BpdiagError("not a valid partial statistic: {!r}".format(e))
+    self._count += count
+    self._skipped += skipped
+    for attr in STAT_FIELDS + DERIVED_FIELDS:
+      count, total, low, high, m2 = parts[attr]
+      if not count:
+        continue
+      totals = self._totals[attr]
+      if totals[0]:
+        # combine the variances (Chan et al.)
+        delta = float(total) / count - float(totals[1]) / totals[0]
+        m2 += delta * delta * totals[0] * count / (totals[0] + count)
+      totals[0] += count
+      totals[1] += total
+      totals[2] = low if totals[2] is None else min(totals[2], low)
+      totals[3] = high if totals[3] is None else max(totals[3], high)
+      totals[4] += m2
+    self.evaluate_totals()
+
+  def as_partial(self):
+    """
+    Return the totals of this instance as a dictionary, that can be dumped to
+    JSON and merged back with :meth:`update`.
+
+    """
+    partial = {
+      'partial': PARTIAL_VERSION, 'count': len(self), 'skipped': self.skipped
+    }
+    for attr in STAT_FIELDS + DERIVED_FIELDS:
+      partial[attr] = dict(zip(PARTIAL_KEYS, self._totals[attr]))
+    return partial
+
+  def as_dict(self, values=None):
+    """
+    Return the statistics as a dictionary. The readings are converted to
+    dictionaries, unless the converted *values* are given.
+
+    """
     data = {}
-    data['data'] = [m.as_dict() if m else None for m in self.values]
+    if values is None:
+      values = [m.as_dict() if m else None for m in self.values]
+      if self.timestamps is not None:
+        for i, value in enumerate(values):
+          if value is not None:
+            self.timestamps.restore(i, value)
+    data['data'] = values
     for attr in self.__dict__:
-      if attr != 'data':
+      if attr not in ('data', 'timestamps') and not attr.startswith('_'):
         data[attr] = getattr(self, attr)
     return data
 
+  def __len__(self):
+    return self._count
+
+  def __nonzero__(self):
+    return True if len(self) else False
+
+
+class InputPosition(object):
+
+  """
+  The current position of :func:`read_files` in its input.
+
+  *file* is the index of the current file in the list of filenames and *line*
+  the number of the current line in that file (starting with 1). Both are
+  ``None`` until the first line is read.
+
+  """
+
+  __slots__ = ('file', 'line')
+
+  def __init__(self):
+    self.file = None
+    self.line = None
+
+
+class TimeIndex(object):
+
+  """
+  Index over *measurements* (a list of :cls:`Measurement` instances and / or
+  ``None`` values), sorted by their timestamps: taken from the
+  :cls:`Timestamps` instance *timestamps* of the measurements, if set, or
+  parsed from their attributes (see :func:`get_timestamp`).
+
+  **stamps** is the sorted integer array of timestamps and **positions**
+  holds the position of the matching measurement in *measurements*.
+  Measurements without a date are not indexed.
+
+  """
+
+  def __init__(self, measurements, timestamps=None):
+    if timestamps is None:
+      stamps = (
+        get_timestamp(m) if m is not None else None for m in measurements
+      )
+    else:
+      stamps = (
+        stamp if kind else None
+        for stamp, kind in itertools.izip(timestamps.stamps, timestamps.kinds)
+      )
+    pairs = sorted(
+      (stamp, position)
+      for position, stamp in enumerate(stamps)
+      if stamp is not None
+    )
+    self.size = len(measurements)
+    self.stamps = array.array('l', (stamp for stamp, position in pairs))
+    self.positions = array.array('i', (position for stamp, position in pairs))
+
+  def range(self, start=None, end=None):
+    """
+    Return the positions of all measurements with timestamps between *start*
+    and *end* (both inclusive, ``None`` for an open end), sorted by time.
+
+    """
+    low = 0 if start is None else bisect.bisect_left(self.stamps, start)
+    high = len(self.stamps) if end is None else bisect.bisect_right(self.stamps, end)
+    return self.positions[low:high].tolist()
+
+  def rolling(self, values, window):
+    """
+    Return the rolling min, max and avg of *values* as a tuple of three lists.
+
+    *values* need to be in the order of the indexed measurements. For each
+    indexed value the statistics are calculated over all values in the
+    *window* (in seconds) ending with its timestamp (including all values
+    with the same timestamp). The results are in the order of *values* too,
+    with ``None`` for not indexed or ``None`` values.
+
+    This takes O(n): every value enters and leaves the window once, the sum
+    is kept running and min / max are taken from monotonic deques.
+
+    """
+    mins, maxs, avgs = [None] * self.size, [None] * self.size, [None] * self.size
+    stamps, positions = self.stamps, self.positions
+    window_min, window_max = collections.deque(), collections.deque()
+    total = count = start = end = 0
+    while end < len(positions):
+      # all values with the same timestamp share one window
+      first, stamp = end, stamps[end]
+      # drop the values leaving the window
+      while start < first and stamps[start] <= stamp - window:
+        old = values[positions[start]]
+        if old is not None:
+          total -= old
+          count -= 1
+        if window_min and window_min[0] == start:
+          window_min.popleft()
+        if window_max and window_max[0] == start:
+          window_max.popleft()
+        start += 1
+      # add the new ones
+      while end < len(positions) and stamps[end] == stamp:
+        value = values[positions[end]]
+        if value is not None:
+          total += value
+          count += 1
+          while window_min and values[positions[window_min[-1]]] >= value:
+            window_min.pop()
+          window_min.append(end)
+          while window_max and values[positions[window_max[-1]]] <= value:
+            window_max.pop()
+          window_max.append(end)
+        end += 1
+      for position in positions[first:end]:
+        if values[position] is not None:
+          mins[position] = values[positions[window_min[0]]]
+          maxs[position] = values[positions[window_max[0]]]
+          avgs[position] = total / count
+    return mins, maxs, avgs
+
+  def __len__(self):
+    return len(self.stamps)
+
+
+class Criteria(object):
+
+  """
+  Selects the readings to keep while parsing.
+
+  *date_from* and *date_to* are date strings (``YYYY-MM-DD``) limiting the
+  date of the readings (both inclusive). *sys*, *dia* and *pulse* can be set
+  to ``(min, max)`` tuples (both inclusive, ``None`` for an open end) to limit
+  the values of the readings.
+
+  Parsers check the date with :meth:`accepts_date` as soon as it's known
+  (before any conversion), and the values with :meth:`accepts`. All rejected
+  readings are counted in **rejected**.
+
+  """
+
+  def __init__(
+    self, date_from=None, date_to=None, sys=None, dia=None, pulse=None
+  ):
+    try:
+      self.date_from = parse_date(date_from) if date_from else None
+      self.date_to = parse_date(date_to) if date_to else None
+    except ValueError as e:
+      raise BpdiagError("invalid date: {}".format(e))
+    self.ranges = [
+      (attr, limits[0], limits[1])
+      for attr, limits in zip(STAT_FIELDS, (sys, dia, pulse)) if limits
+    ]
+    self.rejected = 0
+
+  def accepts_date(self, date):
+    """
+    Return ``True`` if the date string *date* is in range. If a range is set,
+    readings without (valid) date are rejected.
+
+    """
+    if self.date_from is None and self.date_to is None:
+      return True
+    try:
+      stamp = parse_date(date)
+    except (ValueError, AttributeError):
+      self.rejected += 1
+      return False
+    if (
+      (self.date_from is not None and stamp < self.date_from) or
+      (self.date_to is not None and stamp > self.date_to)
+    ):
+      self.rejected += 1
+      return False
+    return True
+
+  def accepts(self, measurement):
+    """Return ``True`` if the values of *measurement* are in range."""
+    for attr, low, high in self.ranges:
+      value = getattr(measurement, attr)
+      if (low is not None and value < low) or (high is not None and value > high):
+        self.rejected += 1
+        return False
+    return True
+
+
+class Repeats(object):
+
+  """
+  Drops repeated readings while parsing.
+
+  Two readings are the same, if the attributes named in *keys* are equal
+  (missing ones count as ``None``). Parsers check every reading they would
+  store with :meth:`accepts` (after the :cls:`Criteria`): the first one is
+  accepted, the repeated ones are counted in **dropped**. The *date* and
+  *time* of readings packed by :cls:`Timestamps` are compared as integers.
+
+  Only the hashes of the *keys* are stored - as a set of integers - not the
+  readings themselves. So memory stays low even for huge inputs, but in the
+  (rare) case of a hash collision a reading might be dropped falsely.
+
+  """
+
+  def __init__(self, keys=DEDUPE_KEYS):
+    self.keys = keys
+    self.seen = set()
+    self.dropped = 0
+
+  def accepts(self, measurement, timestamp=None):
+    """
+    Return ``True`` if *measurement* wasn't seen before. *timestamp* is its
+    ``(stamp, kind)`` tuple, if packed (see :meth:`Timestamps.pack`).
+
+    """
+    stamp, kind = timestamp or (0, 0)
+    values = []
+    for key in self.keys:
+      if key == 'date' and kind:
+        values.append(stamp // 86400)
+      elif key == 'time' and kind == 2:
+        values.append(stamp % 86400)
+      else:
+        values.append(getattr(measurement, key, None))
+    digest = hash(tuple(values))
+    if digest in self.seen:
+      self.dropped += 1
+      return False
+    self.seen.add(digest)
+    return True
+
+
+class Provenance(object):
+
+  """
+  Records where the parsed readings come from.
+
+  For every entry a parser stores (readings and ``None`` values), the file
+  and line number are taken from the :cls:`InputPosition` instance *position*
+  and appended to the parallel integer arrays **files** (indexes into
+  *filenames*) and **lines**. So entry *i* of the (flattened) parser results
+  comes from ``filenames[files[i]]``, line ``lines[i]``. Unknown positions
+  are stored as ``-1``.
+
+  """
+
+  def __init__(self, filenames=(), position=None):
+    self.filenames = filenames
+    self.position = position
+    self.files = array.array('i')
+    self.lines = array.array('i')
+
+  def add(self, count=1):
+    """Record the current position for the next *count* entries."""
+    if self.position is None or self.position.file is None:
+      file, line = -1, -1
+    else:
+      file, line = self.position.file, self.position.line
+    self.files.extend([file] * count)
+    self.lines.extend([line] * count)
+
+  def replace(self, index):
+    """Record the current position for the existing entry *index*."""
+    if self.position is None or self.position.file is None:
+      self.files[index], self.lines[index] = -1, -1
+    else:
+      self.files[index] = self.position.file
+      self.lines[index] = self.position.line
+
+  def filename(self, index):
+    """Return the name of the file of entry *index* (or ``None``)."""
+    file = self.files[index]
+    return self.filenames[file] if 0 <= file < len(self.filenames) else None
+
+  def location(self, index):
+    """Return a string representing the location of entry *index*."""
+    filename = self.filename(index)
+    if filename is None:
+      return "<input>"
+    return "{}:{}".format(filename, self.lines[index])
+
+  def __len__(self):
+    return len(self.files)
+
+
+class Timestamps(object):
+
+  """
+  Holds the dates and times of the parsed readings as integers.
+
+  Parsers :meth:`pack` the *date* and *time* strings of each reading: valid
+  ones are removed from the keywords for the :cls:`Measurement` and kept as
+  the **current** UTC epoch timestamp instead (the strings are parsed by
+  :func:`parse_date` and :func:`parse_time`, which cache their results). For
+  every entry they store (readings and ``None`` values), the current one is
+  appended to the parallel integer arrays **stamps** and **kinds** with
+  :meth:`add`. So entry *i* of the (flattened) parser results has the
+  timestamp ``stamps[i]``, if ``kinds[i]`` is set: ``1`` for a date, ``2``
+  for a date and time (``0`` for none).
+
+  The strings are only rebuild (in ``YYYY-MM-DD`` and ``HH:MM`` format) on
+  export, with :meth:`restore`.
+
+  """
+
+  def __init__(self):
+    self.stamps = array.array('l')
+    self.kinds = array.array('b')
+    self.current = (0, 0)
+
+  def pack(self, values):
+    """
+    Remove the valid *date* and *time* strings from the dictionary *values*
+    and return their ``(stamp, kind)`` tuple, which is kept as the current
+    one. Invalid strings stay in *values*.
+
+    """
+    self.current = (0, 0)
+    date, time = values.get('date'), values.get('time')
+    if date is None:
+      return self.current
+    try:
+      stamp = parse_date(date)
+    except ValueError:
+      return self.current
+    del values['date']
+    self.current = (stamp, 1)
+    if time is not None:
+      try:
+        self.current = (stamp + parse_time(time), 2)
+      except ValueError:
+        return self.current
+      del values['time']
+    return self.current
+
+  def add(self, reading=True):
+    """
+    Record the current timestamp for the next entry (none, if it isn't a
+    *reading*).
+
+    """
+    stamp, kind = self.current if reading else (0, 0)
+    self.stamps.append(stamp)
+    self.kinds.append(kind)
+
+  def replace(self, index, reading=True):
+    """Record the current timestamp for the existing entry *index*."""
+    self.stamps[index], self.kinds[index] = (
+      self.current if reading else (0, 0)
+    )
+
+  def get(self, index):
+    """Return the ``(stamp, kind)`` tuple of entry *index*."""
+    return self.stamps[index], self.kinds[index]
+
+  def timestamp(self, index):
+    """Return the timestamp of entry *index* (or ``None``)."""
+    return self.stamps[index] if self.kinds[index] else None
+
+  def restore(self, index, values):
+    """
+    Add the *date* and *time* strings of entry *index* to the dictionary
+    *values* (eg. from :meth:`Measurement.as_dict`) and return it.
+
+    """
+    stamp, kind = self.stamps[index], self.kinds[index]
+    if kind:
+      values['date'] = format_date(stamp)
+    if kind == 2:
+      values['time'] = format_time(stamp)
+    return values
+
+  def __len__(self):
+    return len(self.stamps)
+
+
+class Reservoir(object):
+
+  """
+  Keeps a uniform random sample of at most *size* entries, in fixed memory.
+
+  Parsers :meth:`append` every reading they would store (but no ``None``
+  values) and return the **values** list instead. Once *size* entries are
+  stored, each new entry replaces a random stored one with the right
+  probability (*reservoir sampling*), so every entry seen ends up in the
+  sample with the same chance. The **seen** attribute counts all entries.
+
+  *seed* seeds the random number generator, to get the same sample for the
+  same input. If *provenance* is set to a :cls:`Provenance` instance or
+  *timestamps* to a :cls:`Timestamps` instance (the one packing the entries),
+  they are kept in sync with *values*.
+
+  """
+
+  def __init__(self, size, seed=None, provenance=None, timestamps=None):
+    self.size = size
+    self.provenance = provenance
+    self.timestamps = timestamps
+    self.random = random.Random(seed)
+    self.seen = 0
+    self.values = []
+
+  def append(self, value):
+    """Offer *value* to the sample."""
+    self.seen += 1
+    if len(self.values) < self.size:
+      self.values.append(value)
+      if self.provenance is not None:
+        self.provenance.add()
+      if self.timestamps is not None:
+        self.timestamps.add(value is not None)
+      return
+    index = self.random.randrange(self.seen)
+    if index < self.size:
+      self.values[index] = value
+      if self.provenance is not None:
+        self.provenance.replace(index)
+      if self.timestamps is not None:
+        self.timestamps.replace(index, value is not None)
+
+  def extend(self, values):
+    """Offer all entries in *values* to the sample."""
+    for value in values:
+      self.append(value)
+
   def __len__(self):
     return len(self.values)
 
+
+class ErrorLog(object):
+
+  """
+  Collects parsing errors, so parsers can log them instead of raising them.
+
+  Every error is counted, but only the first *limit* ones are stored as
+  ``(file, line, token, reason)`` tuples in the **errors** list. If an
+  :cls:`InputPosition` instance is given as *position*, *file* and *line* are
+  taken from it; *file* is an index into *filenames*. Otherwise both are
+  ``None``.
+
+  """
+
+  def __init__(self, limit=10, filenames=(), position=None):
+    self.limit = limit
+    self.filenames = filenames
+    self.position = position
+    self.count = 0
+    self.errors = []
+
+  def add(self, reason, token=None):
+    """Count the error *reason* and store it, if the *limit* isn't reached."""
+    self.count += 1
+    if len(self.errors) < self.limit:
+      if self.position is None:
+        self.errors.append((None, None, token, reason))
+      else:
+        self.errors.append(
+          (self.position.file, self.position.line, token, reason)
+        )
+
+  def location(self, file, line):
+    """Return a string representing the location *file* / *line*."""
+    if file is None:
+      return "<input>"
+    try:
+      filename = self.filenames[file]
+    except IndexError:
+      filename = "<file {}>".format(file)
+    return "{}:{}".format(filename, line)
+
+  def summary(self):
+    """Return a string listing the stored errors."""
+    lines = ["{} parsing error(s), the first {} are:".format(
+      self.count, len(self.errors)
+    )]
+    for file, line, token, reason in self.errors:
+      lines.append(":: {}: {}".format(self.location(file, line), reason))
+    return "\n".join(lines)
+
+  def __len__(self):
+    return self.count
+
   def __nonzero__(self):
-    return True if self.data else False
+    return True if self.count else False
+
+
+class Store(object):
+
+  """
+  Stores readings in the SQLite database *filename*.
+
+  Each reading is a row in the *readings* table. Besides the *date*, *time*,
+  *sys*, *dia* and *pulse* columns, the date (*day*) and the timestamp
+  (*stamp*) are stored as UTC epoch seconds, so range queries can use the
+  index on them. Additional attributes are stored as JSON in *extra*.
+
+  Statistics (see :meth:`partial` and :meth:`buckets`) are calculated by SQL
+  aggregates, without loading the readings.
+
+  The schema is only created with *create* (eg. to :meth:`ingest`), else
+  *filename* needs to be a database created that way.
+
+  """
+
+  COLUMNS = (
+    'date', 'time', 'day', 'stamp', 'sys', 'dia', 'pulse', 'extra', 'dedupe'
+  )
+  EXPRESSIONS = {
+    'sys': 'sys', 'dia': 'dia', 'pulse': 'pulse',
+    'pp': '(sys - dia)', 'map': '(dia + (sys - dia) / 3.0)'
+  }
+
+  def __init__(self, filename, create=False):
+    self.filename = filename
+    self.db = sqlite3.connect(filename)
+    if not create:
+      if not self.db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'readings'"
+      ).fetchone():
+        raise BpdiagError("not a bpdiag database: '{}'".format(filename))
+      return
+    with self.db:
+      self.db.execute(
+        "CREATE TABLE IF NOT EXISTS readings ("
+        "id INTEGER PRIMARY KEY, date TEXT, time TEXT, "
+        "day INTEGER, stamp INTEGER, "
+        "sys INTEGER, dia INTEGER, pulse INTEGER, extra TEXT, dedupe TEXT)"
+      )
+      self.db.execute(
+        "CREATE INDEX IF NOT EXISTS readings_day ON readings (day, stamp)"
+      )
+      self.db.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS readings_dedupe ON readings (dedupe)"
+      )
+
+  def ingest(self, data, batch=1000, timestamps=None, keys=None):
+    """
+    Store all readings from *data* (a list or an :cls:`AlignedData` instance)
+    and return how many were stored. ``None`` values are skipped.
+    *timestamps* is the :cls:`Timestamps` instance of *data*, if any.
+
+    If *keys* is set (see :cls:`Repeats`), the values of those attributes are
+    stored as unique *dedupe* key and readings already stored with the same
+    key (eg. by an earlier run) are skipped.
+
+    The rows are inserted with ``executemany``, *batch* rows per transaction.
+
+    """
+    if isinstance(data, AlignedData):
+      data = data.values
+    rows = (
+      self.as_row(m, timestamps, i, keys)
+      for i, m in enumerate(data) if m is not None
+    )
+    sql = "INSERT OR IGNORE INTO readings ({}) VALUES ({})".format(
+      ', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS))
+    )
+    changes = self.db.total_changes
+    while True:
+      chunk = list(itertools.islice(rows, batch))
+      if not chunk:
+        return self.db.total_changes - changes
+      with self.db:
+        self.db.executemany(sql, chunk)
+
+  def as_row(self, measurement, timestamps=None, index=None, keys=None):
+    """
+    Return the row (a tuple in the order of **COLUMNS**) for *measurement*,
+    the entry *index* of the :cls:`Timestamps` instance *timestamps* (if set).
+    The *dedupe* key is only set with *keys*.
+
+    """
+    values = measurement.as_dict()
+    if timestamps is None:
+      stamp = get_timestamp(measurement)
+    else:
+      timestamps.restore(index, values)
+      stamp = timestamps.timestamp(index)
+    dedupe = json.dumps([values.get(key) for key in keys]) if keys else None
+    date, time = values.pop('date', None), values.pop('time', None)
+    day = stamp - stamp % 86400 if stamp is not None else None
+    for attr in STAT_FIELDS:
+      del values[attr]
+    return (
+      date, time, day, stamp,
+      measurement.sys, measurement.dia, measurement.pulse,
+      json.dumps(values) if values else None, dedupe
+    )
+
+  def where(self, criteria=None):
+    """
+    Return a ``WHERE`` clause (or an empty string) and its parameters for the
+    :cls:`Criteria` instance *criteria*.
+
+    """
+    clauses, params = [], []
+    if criteria is not None:
+      if criteria.date_from is not None:
+        clauses.append("day >= ?")
+        params.append(criteria.date_from)
+      if criteria.date_to is not None:
+        clauses.append("day <= ?")
+        params.append(criteria.date_to)
+      for attr, low, high in criteria.ranges:
+        if low is not None:
+          clauses.append("{} >= ?".format(attr))
+          params.append(low)
+        if high is not None:
+          clauses.append("{} <= ?".format(attr))
+          params.append(high)
+    if not clauses:
+      return "", params
+    return " WHERE " + " AND ".join(clauses), params
+
+  def select(self, criteria=None, limit=None):
+    """
+    Return a list of :cls:`Measurement` instances for all stored readings
+    matching *criteria*, in the order they were stored. If *limit* is set,
+    only the first *limit* ones.
+
+    """
+    where, params = self.where(criteria)
+    if limit is not None:
+      where += " ORDER BY id LIMIT ?"
+      params.append(limit)
+    else:
+      where += " ORDER BY id"
+    data = []
+    for date, time, sys, dia, pulse, extra in self.db.execute(
+      "SELECT date, time, sys, dia, pulse, extra FROM readings{}".format(where),
+      params
+    ):
+      kwargs = json.loads(extra) if extra else {}
+      if date is not None:
+        kwargs['date'] = date
+      if time is not None:
+        kwargs['time'] = time
+      data.append(Measurement(sys, dia, pulse, **kwargs))
+    return data
+
+  def partial(self, criteria=None):
+    """
+    Return the partial statistic (see :meth:`Statistic.as_partial`) of all
+    stored readings matching *criteria*.
+
+    """
+    fields = STAT_FIELDS + DERIVED_FIELDS
+    where, params = self.where(criteria)
+    row = self.db.execute(
+      "SELECT COUNT(*), {} FROM readings{}".format(
+        ', '.join(
+          "COUNT({0}), COALESCE(SUM({0}), 0), MIN({0}), MAX({0}), "
+          "COALESCE(SUM({0} * {0}), 0)".format(self.EXPRESSIONS[attr])
+          for attr in fields
+        ),
+        where
+      ), params
+    ).fetchone()
+    partial = {'partial': PARTIAL_VERSION, 'count': row[0], 'skipped': 0}
+    for i, attr in enumerate(fields):
+      count, total, low, high, squares = row[1 + i * 5:6 + i * 5]
+      # the sum of squared differences from the mean
+      m2 = max(squares - float(total) * total / count, 0.0) if count else 0.0
+      partial[attr] = dict(zip(PARTIAL_KEYS, (count, total, low, high, m2)))
+    return partial
+
+  def buckets(self, period='day', criteria=None):
+    """
+    Return a list with the count and the min / max / avg values of all stored
+    readings matching *criteria*, grouped by *period* (a key from the global
+    **BUCKETS** dictionary). Readings without date are ignored.
+
+    Each entry is a dictionary with the keys *period* (eg. ``2013-01`` for a
+    month), *count*, *sys_min*, *sys_max*, *sys_avg*, *dia_min*, etc.
+
+    """
+    where, params = self.where(criteria)
+    where = (where + " AND " if where else " WHERE ") + "day IS NOT NULL"
+    buckets = []
+    for row in self.db.execute(
+      "SELECT strftime(?, day, 'unixepoch') AS period, COUNT(*), {} "
+      "FROM readings{} GROUP BY period ORDER BY period".format(
+        ', '.join(
+          "MIN({0}), MAX({0}), SUM({0})".format(attr) for attr in STAT_FIELDS
+        ),
+        where
+      ), [BUCKETS[period]] + params
+    ):
+      bucket = {'period': row[0], 'count': row[1]}
+      for i, attr in enumerate(STAT_FIELDS):
+        low, high, total = row[2 + i * 3:5 + i * 3]
+        bucket[attr + '_min'] = low
+        bucket[attr + '_max'] = high
+        bucket[attr + '_avg'] = total / row[1]
+      buckets.append(bucket)
+    return buckets
+
+  def count(self, criteria=None):
+    """Return the number of stored readings matching *criteria*."""
+    where, params = self.where(criteria)
+    return self.db.execute(
+      "SELECT COUNT(*) FROM readings{}".format(where), params
+    ).fetchone()[0]
+
+  def __len__(self):
+    return self.count()
+
+
+class Exporter(object):
+
+  """
+  Writes the outputs for the :cls:`Statistic` instance *stats*.
+
+  Add JSON dumps (see **JSON_OUTPUTS**) with :meth:`add_json` and other
+  outputs (eg. :func:`output_chart`) with :meth:`add_task`, then call
+  :meth:`run`. The readings are converted for all dumps in a single pass.
+  Then each output is serialized and written by its own thread, so they
+  overlap. Dumps without a filename are printed to *STDOUT* in the order
+  they were added, each as soon as it (and the ones before it) is serialized.
+
+  If *provenance* is set to the :cls:`Provenance` instance of the readings,
+  their file and line are added to the *json-obj* dump (readings with own
+  *file* or *line* attributes raise a :cls:`BpdiagError`). The *date* and *time*
+  strings are rebuild from the :cls:`Timestamps` of *stats* (if any). *indent*,
+  *separators* and *sort_keys* are handed to ``json.dumps``.
+
+  """
+
+  def __init__(
+    self, stats, provenance=None, indent=None, separators=None,
+    sort_keys=False
+  ):
+    self.stats = stats
+    self.provenance = provenance
+    self.options = {
+      'indent': indent, 'separators': separators, 'sort_keys': sort_keys
+    }
+    self.dumps = []
+    self.tasks = []
+
+  def add_json(self, kind, filename=None):
+    """Add the JSON dump *kind*, written to *filename* (or *STDOUT*)."""
+    if kind not in JSON_OUTPUTS:
+      raise BpdiagError("unknown JSON output: '{}'".format(kind))
+    self.dumps.append((kind, filename))
+
+  def add_task(self, func, *args):
+    """Add a call to *func* with *args*, to run along with the dumps."""
+    self.tasks.append((func, args))
+
+  def convert(self):
+    """
+    Return a dictionary with the object to dump for each added kind. The
+    readings are converted in one pass for all of them, building only the
+    representations (tuples, dictionaries) the added kinds need.
+
+    """
+    kinds = set(kind for kind, filename in self.dumps)
+    documents = {}
+    # build only the representations needed by the added dumps
+    tuples = [] if 'json' in kinds else None
+    values = [] if kinds & {'json-obj', 'json-stats'} else None
+    objects = [] if 'json-obj' in kinds else None
+    provenance = self.provenance if objects is not None else None
+    timestamps = self.stats.timestamps
+    if tuples is not None or values is not None:
+      for i, m in enumerate(self.stats.values):
+        if tuples is not None:
+          tuples.append(m.as_tuple() if m is not None else None)
+        if values is None:
+          continue
+        obj = m.as_dict() if m is not None else None
+        if obj is not None and timestamps is not None:
+          timestamps.restore(i, obj)
+        values.append(obj)
+        if objects is not None:
+          if obj is not None and provenance is not None:
+            if 'file' in obj or 'line' in obj:
+              raise BpdiagError(
+                "can't add file and line to reading {}, it has its own "
+                "attribute(s) of that name".format(i)
+              )
+            obj = dict(
+              obj, file=provenance.filename(i), line=provenance.lines[i]
+            )
+          objects.append(obj)
+    if tuples is not None:
+      documents['json'] = (
+        list(self.stats.data.split(tuples)) if self.stats.is_list else tuples
+      )
+    if objects is not None:
+      documents['json-obj'] = (
+        list(self.stats.data.split(objects)) if self.stats.is_list
+        else objects
+      )
+    if 'json-stats' in kinds:
+      documents['json-stats'] = self.stats.as_dict(values)
+    if 'json-partial' in kinds:
+      documents['json-partial'] = self.stats.as_partial()
+    return documents
+
+  def write(self, document, filename=None):
+    """
+    Serialize *document* to JSON and write it to *filename*. Return the
+    filename, or the JSON string if *filename* isn't set.
+
+    """
+    dump = json.dumps(document, **self.options)
+    if filename is None:
+      return dump
+    with open(filename, 'w') as fh:
+      fh.write(dump)
+      fh.write('\n')
+    return filename
+
+  def run(self):
+    """
+    Write all outputs and return a list of the results: the filename (or
+    ``None`` for *STDOUT*) of each dump and the return value of each task.
+
+    """
+    if not self.dumps and not self.tasks:
+      return []
+    documents = self.convert()
+    pool = ThreadPool(len(self.dumps) + len(self.tasks))
+    try:
+      dumps = [
+        pool.apply_async(self.write, (documents[kind], filename))
+        for kind, filename in self.dumps
+      ]
+      tasks = [pool.apply_async(func, args) for func, args in self.tasks]
+      results = []
+      for (kind, filename), result in zip(self.dumps, dumps):
+        if filename is None:
+          print result.get(), "\n\n"
+          results.append(None)
+        else:
+          results.append(result.get())
+      return results + [result.get() for result in tasks]
+    finally:
+      pool.terminate()
+
+
+def parse_date(string):
+  """
+  Return the date *string* (``YYYY-MM-DD``) as UTC epoch timestamp (seconds).
+
+  The results are cached in the global **DATE_CACHE** dictionary, because
+  usually lots of readings share the same date.
+
+  """
+  try:
+    return DATE_CACHE[string]
+  except KeyError:
+    year, month, day = [int(part) for part in string.split('-')]
+    stamp = (datetime.date(year, month, day).toordinal() - EPOCH_ORDINAL) * 86400
+    DATE_CACHE[string] = stamp
+    return stamp
+
+
+def parse_time(string):
+  """
+  Return the time *string* (``HH:MM`` or ``HH:MM:SS``) as seconds.
+
+  The results are cached in the global **TIME_CACHE** dictionary.
+
+  """
+  try:
+    return TIME_CACHE[string]
+  except KeyError:
+    parts = [int(part) for part in string.split(':')]
+    if not 2 <= len(parts) <= 3 or not (
+      0 <= parts[0] < 24 and all(0 <= part < 60 for part in parts[1:])
+    ):
+      raise ValueError("invalid time: '{}'".format(string))
+    seconds = sum(part * factor for part, factor in zip(parts, (3600, 60, 1)))
+    TIME_CACHE[string] = seconds
+    return seconds
+
+
+def format_date(stamp):
+  """
+  Return the date of the UTC epoch timestamp *stamp* as string
+  (``YYYY-MM-DD``).
+
+  The results are cached (per day) in the global **DATE_STRINGS** dictionary.
+
+  """
+  day = stamp // 86400
+  try:
+    return DATE_STRINGS[day]
+  except KeyError:
+    string = datetime.date.fromordinal(EPOCH_ORDINAL + day).isoformat()
+    DATE_STRINGS[day] = string
+    return string
+
+
+def format_time(stamp):
+  """
+  Return the time of the UTC epoch timestamp *stamp* as string (``HH:MM``, or
+  ``HH:MM:SS`` if there are seconds).
+
+  """
+  minutes, seconds = divmod(stamp % 86400, 60)
+  if seconds:
+    return "{:02}:{:02}:{:02}".format(minutes // 60, minutes % 60, seconds)
+  return "{:02}:{:02}".format(minutes // 60, minutes % 60)
+
+
+def get_timestamp(measurement):
+  """
+  Return the UTC epoch timestamp of *measurement*, taken from its *date* and
+  *time* attributes. Return ``None`` if it has no (valid) date.
+
+  """
+  try:
+    stamp = parse_date(measurement.date)
+  except (AttributeError, ValueError):
+    return None
+  try:
+    stamp += parse_time(measurement.time)
+  except (AttributeError, ValueError):
+    pass
+  return stamp
+
+
+def parse_range(string):
+  """Return a ``(min, max)`` tuple parsed from a ``MIN:MAX`` string."""
+  try:
+    low, high = [int(part) if part.strip() else None for part in string.split(':')]
+  except ValueError:
+    raise argparse.ArgumentTypeError(
+      "needs to be a range like MIN:MAX, MIN: or :MAX"
+    )
+  return low, high
+
+
+def parse_day(string):
+  """Return the date *string* (``YYYY-MM-DD``), if it's a valid date."""
+  try:
+    parse_date(string)
+  except ValueError:
+    raise argparse.ArgumentTypeError("needs to be a valid date (YYYY-MM-DD)")
+  return string
+
+
+def parse_count(string):
+  """Return a non-negative integer parsed from *string*."""
+  try:
+    count = int(string)
+  except ValueError:
+    count = -1
+  if count < 0:
+    raise argparse.ArgumentTypeError("needs to be an integer >= 0")
+  return count
 
 
 def parse_plaintext(
   lines, align_lines=False, keep_empty_lines=False,
-  entries=0, skip='-', separator='/', delimiter=',', check=False
+  entries=0, skip='-', separator='/', delimiter=',', check=False,
+  errors=None, criteria=None, repeats=None, provenance=None, head=0,
+  sample=None
 ):
   """
   Return a list of :cls:`Measurement` instances parsed from *lines*.
 
-  If *align_lines* is set, a list of list is returned instead.
-  Where each line is represented as a list. If *keep_empty_lines* is also set,
-  empty lines are kept as an empty list.
+  If *align_lines* is set, an :cls:`AlignedData` instance is returned instead,
+  where each line is kept as a list. If *keep_empty_lines* is also set, empty
+  lines are kept as an empty list.
 
   A line can contain any number of sys/dia/pulse strings.
 
@@ -274,8 +1561,34 @@ def parse_plaintext(
   reported. If set to ``False`` only errors through skipped entries or missing
   ones (while *entries* is set) are ignored.
 
+  If *errors* is set to an :cls:`ErrorLog` instance, reported errors are
+  logged there instead of raised and the offending entries are ignored
+  (*entries* stores ``None`` values for them).
+
+  If *criteria* is set to a :cls:`Criteria` instance, only readings with
+  values in range are kept (*entries* stores ``None`` values for the others).
+  The readings have no date, so none is kept if a date range is set.
+
+  If *repeats* is set to a :cls:`Repeats` instance, repeated readings are
+  dropped the same way.
+
+  If *provenance* is set to a :cls:`Provenance` instance, the position of
+  every stored entry is recorded there.
+
+  If *head* is set to a value greater than 0, parsing stops (without reading
+  any more *lines*) as soon as that much readings (not counting ``None``
+  values) are stored. If *sample* is set to a :cls:`Reservoir` instance, the
+  readings (not ``None`` values) are offered to it and its sample is returned
+  (not with *align_lines*).
+
   """
-  data = []
+  if sample is not None:
+    if align_lines:
+      raise BpdiagError("aligned lines can't be sampled")
+    data, provenance = sample, None
+  else:
+    data = AlignedData() if align_lines else []
+  count = 0
   # iterate over all lines
   for line in lines:
     line = line.strip()
@@ -292,7 +1605,14 @@ def parse_plaintext(
     for i in range(entries if entries else len(tokens)):
       try:
         token = tokens[i].strip()
-        line_data.append(Measurement(*token.split(separator)))
+        measurement = Measurement(*token.split(separator))
+        # readings have no date here, so a date range rejects all
+        if (criteria is None or (
+          criteria.accepts_date(None) and criteria.accepts(measurement)
+        )) and (repeats is None or repeats.accepts(measurement)):
+          line_data.append(measurement)
+        elif entries:
+          line_data.append(None)
       except IndexError:
         # ``None`` for missing entries on the line if *entries*
         if not check and entries:
@@ -302,7 +1622,11 @@ def parse_plaintext(
           continue
         msg = "not enough measurements on line, needed {} got {} from '{}'"
         msg = msg.format(entries, len(line.split(delimiter)), line)
-        raise BpdiagError(msg)
+        if errors is None:
+          raise BpdiagError(msg)
+        errors.add(msg, line)
+        if entries:
+          line_data.append(None)
       except TypeError:
         # skipped entry or trailing whitespace?
         if not check and (
@@ -317,23 +1641,52 @@ def parse_plaintext(
           continue
         msg = "wrong number of values in token, needed 3 got {} from '{}'"
         msg = msg.format(len(token.split(separator)), token)
-        raise BpdiagError(msg)
+        if errors is None:
+          raise BpdiagError(msg)
+        errors.add(msg, token)
+        if entries:
+          line_data.append(None)
       except ValueError:
         if check is None:
           continue
         msg = "can't convert all values to INT: SYS: '{}', DIA: '{}', PULSE: '{}'"
         msg = msg.format(*token.split(separator))
-        raise BpdiagError(msg)
+        if errors is None:
+          raise BpdiagError(msg)
+        errors.add(msg, token)
+        if entries:
+          line_data.append(None)
     # append line data to collected data
     # print "->", line_data
+    if head:
+      # only readings count, not ``None`` values
+      needed = head - count
+      for i, m in enumerate(line_data):
+        if m is not None:
+          needed -= 1
+          if not needed:
+            line_data = line_data[:i + 1]
+            break
+      count = head - needed
+    if provenance is not None:
+      provenance.add(len(line_data))
     if align_lines:
       data.append(line_data)
+    elif sample is not None:
+      data.extend(m for m in line_data if m is not None)
     else:
       data.extend(line_data)
+    if head and count >= head:
+      break
+  if sample is not None:
+    return sample.values
   return data
 
 
-def parse_json(lines, as_obj=False, check=False):
+def parse_json(
+  lines, as_obj=False, check=False, errors=None, criteria=None, repeats=None,
+  head=0, sample=None
+):
   """
   Return a list of :cls:`Measurement` instances parsed from *lines*.
 
@@ -349,21 +1702,51 @@ def parse_json(lines, as_obj=False, check=False):
   treated as an array with the SYS/DIA/PULSE values.
 
   If the parsing fails, an error is raised, except if *check* is ``None``,
-  then an empty list will be returned instead.
+  then an empty list will be returned instead. If *errors* is set to an
+  :cls:`ErrorLog` instance, the error is logged there and an empty list is
+  returned too.
+
+  If *criteria* is set to a :cls:`Criteria` instance, only the readings in
+  range are returned. If *repeats* is set to a :cls:`Repeats` instance,
+  repeated readings are dropped.
+
+  If *head* is set to a value greater than 0, only that much readings are
+  returned. If *sample* is set to a :cls:`Reservoir` instance, the readings
+  are offered to it and its sample is returned.
 
   """
   try:
     if as_obj:
-      return [Measurement(**entry) for entry in json.loads(''.join(lines))]
+      data = [Measurement(**entry) for entry in json.loads(''.join(lines))]
     else:
-      return [Measurement(*entry) for entry in json.loads(''.join(lines))]
+      data = [Measurement(*entry) for entry in json.loads(''.join(lines))]
   except ValueError as e:
     if check is None:
       return []
-    raise BpdiagError(str(e))
+    if errors is None:
+      raise BpdiagError(str(e))
+    errors.add(str(e))
+    return []
+  if criteria is not None:
+    data = [
+      m for m in data
+      if criteria.accepts_date(getattr(m, 'date', None)) and criteria.accepts(m)
+    ]
+  if repeats is not None:
+    data = [m for m in data if repeats.accepts(m)]
+  if head:
+    data = data[:head]
+  if sample is not None:
+    sample.extend(data)
+    return sample.values
+  return data
 
 
-def parse_regex(lines, regex=PARSERS['regex']['def_regex'], check=False):
+def parse_regex(
+  lines, regex=PARSERS['regex']['def_regex'], check=False, errors=None,
+  criteria=None, repeats=None, provenance=None, timestamps=None, head=0,
+  sample=None
+):
   """
   Return a list of :cls:`Measurement` instances parsed from *lines*.
 
@@ -371,57 +1754,273 @@ def parse_regex(lines, regex=PARSERS['regex']['def_regex'], check=False):
 
   Every none matching line or line without SYS/DIA/PULSE values raises an
   error. If *check* is ``None`` those errors are ignored and ``None``
-  values are stored instead.
+  values are stored instead. If *errors* is set to an :cls:`ErrorLog`
+  instance, the errors are logged there and ``None`` values are stored too.
+
+  If *criteria* is set to a :cls:`Criteria` instance, only readings in range
+  are kept. The *date* group of a matching line is checked before any values
+  are converted. If *repeats* is set to a :cls:`Repeats` instance, repeated
+  readings are dropped.
+
+  If *provenance* is set to a :cls:`Provenance` instance, the position of
+  every stored entry is recorded there. If *timestamps* is set to a
+  :cls:`Timestamps` instance, valid *date* and *time* groups are stored there
+  as integer timestamp, not as strings on the readings.
+
+  If *head* is set to a value greater than 0, parsing stops (without reading
+  any more *lines*) as soon as that much readings (not counting ``None``
+  values) are stored. If *sample* is set to a :cls:`Reservoir` instance, the
+  readings (not ``None`` values) are offered to it and its sample is returned.
 
   """
   regex = re.compile(regex)
-  data = []
+  if sample is not None:
+    # the sample records the timestamps of the entries it keeps
+    data, provenance, column = sample, None, None
+  else:
+    data, column = [], timestamps
+  count = 0
   # iterate over all non-empty lines
   for line in itertools.ifilter(None, (line.strip() for line in lines)):
     try:
       m = regex.search(line)
       if m:
-        data.append(Measurement(**m.groupdict()))
-      else:
-        if check is None:
-          data.append(None)
-        else:
-          raise BpdiagError("no match on line: '{}'".format(line))
-    except TypeError:
-      if check is None:
-        data.append(None)
+        groups = m.groupdict()
+        if criteria is not None and not criteria.accepts_date(
+          groups.get('date')
+        ):
+          continue
+        packed = timestamps.pack(groups) if timestamps is not None else None
+        measurement = Measurement(**groups)
+        if (criteria is None or criteria.accepts(measurement)) and (
+          repeats is None or repeats.accepts(measurement, packed)
+        ):
+          data.append(measurement)
+          if provenance is not None:
+            provenance.add()
+          if column is not None:
+            column.add()
+          count += 1
+          if head and count >= head:
+            break
         continue
-      else:
-        raise BpdiagError("missing SYS, DIA and / or PULSE values on line: '{}'".format(line))
+      msg = "no match on line: '{}'".format(line)
+    except TypeError:
+      msg = "missing SYS, DIA and / or PULSE values on line: '{}'".format(line)
+    if check is not None:
+      if errors is None:
+        raise BpdiagError(msg)
+      errors.add(msg, line)
+    # only readings are sampled
+    if sample is not None:
+      continue
+    data.append(None)
+    if provenance is not None:
+      provenance.add()
+    if column is not None:
+      column.add(False)
+  if sample is not None:
+    return sample.values
   return data
 
 
-def parse_csv(lines, fieldnames, delimiter=','):
+def parse_csv(
+  lines, columns=None, delimiter=',', check=False, errors=None, criteria=None,
+  repeats=None, provenance=None, timestamps=None, head=0, sample=None,
+  position=None
+):
   """
   Return a list of :cls:`Measurement` instances parsed from *lines*.
 
-  Each line is treated as a couple of values, seperated by *delimiter*. Each
-  of the values is maped to the names in *fieldnames*. The resulting pairing
-  is then used as *kwargs* to create the :cls:`Measurement` instances.
-
-  If a line has more fields than the fieldnames, the remaining data is added
-  to the *extra* attribute of the instance. If the line has fewer fields, the
-  remaining keys take the value of ``None``.
+  *lines* are read as CSV rows with fields separated by *delimiter*. The first
+  row needs to be a header with the column names. If *position* is set to the
+  :cls:`InputPosition` instance of *lines* (see :func:`read_files`), the
+  first row of each file is read as header.
+
+  *columns* maps attribute names to column names (see :func:`parse_columns`).
+  Every column from the header with the same name (ignoring case) as one of
+  the fields in **CSV_FIELDS** is used too, if its field isn't mapped already.
+  Columns for SYS, DIA and PULSE are required. All other columns are skipped
+  without being converted.
+
+  Every row that can't be converted raises an error. If *check* is ``None``
+  those errors are ignored and ``None`` values are stored instead. If *errors*
+  is set to an :cls:`ErrorLog` instance, the errors are logged there and
+  ``None`` values are stored too.
+
+  If *criteria* is set to a :cls:`Criteria` instance, only readings in range
+  are kept. The *date* column is checked before any values are converted.
+  If *repeats* is set to a :cls:`Repeats` instance, repeated readings are
+  dropped.
+
+  If *provenance* is set to a :cls:`Provenance` instance, the position of
+  every stored entry is recorded there. If *timestamps* is set to a
+  :cls:`Timestamps` instance, valid *date* and *time* columns are stored
+  there as integer timestamp, not as strings on the readings.
+
+  If *head* is set to a value greater than 0, parsing stops (without reading
+  any more *lines*) as soon as that much readings (not counting ``None``
+  values) are stored. If *sample* is set to a :cls:`Reservoir` instance, the
+  readings (not ``None`` values) are offered to it and its sample is returned.
 
   """
-  return [
-    Measurement(
-      **csv.DictReader(
-        lines, fieldnames, restkey='extra', delimiter=delimiter
+  reader = csv.reader(lines, delimiter=delimiter)
+  if sample is not None:
+    # the sample records the timestamps of the entries it keeps
+    data, provenance, column = sample, None, None
+  else:
+    data, column = [], timestamps
+  count = 0
+  header = file = None
+  for row in reader:
+    # a new file starts with its own header
+    if position is not None and position.file != file:
+      header, file = None, position.file
+    # skip empty rows
+    if not row:
+      continue
+    if header is None:
+      header = [name.strip() for name in row]
+      project, extras, date_index = get_projection(header, columns)
+      continue
+    try:
+      values = project(row)
+      if criteria is not None and not criteria.accepts_date(
+        values[date_index] if date_index else None
+      ):
+        continue
+      kwargs = dict(zip(extras, values[3:]))
+      packed = timestamps.pack(kwargs) if timestamps is not None else None
+      measurement = Measurement(*values[:3], **kwargs)
+      if (criteria is None or criteria.accepts(measurement)) and (
+        repeats is None or repeats.accepts(measurement, packed)
+      ):
+        data.append(measurement)
+        if provenance is not None:
+          provenance.add()
+        if column is not None:
+          column.add()
+        count += 1
+        if head and count >= head:
+          break
+      continue
+    except IndexError:
+      msg = "not enough fields in row, needed {} got {}: '{}'".format(
+        len(header), len(row), delimiter.join(row)
       )
+    except ValueError:
+      msg = "can't convert all values to INT: SYS: '{}', DIA: '{}', PULSE: '{}'"
+      msg = msg.format(*values[:3])
+    if check is not None:
+      if errors is None:
+        raise BpdiagError(msg)
+      errors.add(msg, delimiter.join(row))
+    # only readings are sampled
+    if sample is not None:
+      continue
+    data.append(None)
+    if provenance is not None:
+      provenance.add()
+    if column is not None:
+      column.add(False)
+  if sample is not None:
+    return sample.values
+  return data
+
+
+def get_projection(header, columns=None):
+  """
+  Return a tuple for the CSV *header* (a list of column names) and the
+  *columns* mapping (see :func:`parse_csv`): a function projecting a row to
+  its SYS, DIA and PULSE values followed by the *extras*, the list of the
+  extra attribute names and the index of the *date* in the projection (or
+  ``None``).
+
+  """
+  columns = dict(columns or {})
+  for name in header:
+    if name.lower() in CSV_FIELDS:
+      columns.setdefault(name.lower(), name)
+  missing = [attr for attr in STAT_FIELDS if attr not in columns]
+  if missing:
+    raise BpdiagError("no column for: {}".format(', '.join(missing)))
+  # project the needed columns in a fixed order: sys, dia, pulse, extras..
+  extras = sorted(attr for attr in columns if attr not in STAT_FIELDS)
+  try:
+    project = operator.itemgetter(*(
+      header.index(columns[attr]) for attr in STAT_FIELDS + tuple(extras)
+    ))
+  except ValueError:
+    raise BpdiagError("column(s) not in header: {}".format(', '.join(
+      columns[attr] for attr in sorted(columns) if columns[attr] not in header
+    )))
+  date_index = 3 + extras.index('date') if 'date' in extras else None
+  return project, extras, date_index
+
+
+def parse_columns(string):
+  """
+  Return a dictionary parsed from a comma separated list of
+  ``attribute=column`` pairs, eg: ``sys=Systolic,dia=Diastolic``.
+
+  """
+  try:
+    return dict(
+      (attr.strip().lower(), column.strip())
+      for attr, column in (pair.split('=', 1) for pair in string.split(','))
+    )
+  except ValueError:
+    raise argparse.ArgumentTypeError(
+      "needs to be a comma separated list of ATTR=COLUMN pairs"
     )
-  ]
+
+
+def parse_sqlite(
+  lines, filenames, criteria=None, repeats=None, head=0, sample=None
+):
+  """
+  Return a list of :cls:`Measurement` instances read from the SQLite
+  databases in *filenames* (see :cls:`Store`).
+
+  *lines* are ignored; the databases are queried directly. If *criteria* is
+  set to a :cls:`Criteria` instance, only readings in range are selected (by
+  the database, the others are counted as rejected). If *repeats* is set to a
+  :cls:`Repeats` instance, repeated readings are dropped.
+
+  If *head* is set to a value greater than 0, only that much readings are
+  selected. If *sample* is set to a :cls:`Reservoir` instance, the readings
+  are offered to it and its sample is returned.
+
+  """
+  data = sample if sample is not None else []
+  for filename in filenames:
+    if head and len(data) >= head:
+      break
+    if not os.path.isfile(filename):
+      print >> sys.stderr, "[WARN]: Can't read from '{}'".format(filename)
+      continue
+    try:
+      store = Store(filename)
+      if criteria is not None:
+        criteria.rejected += len(store) - store.count(criteria)
+      if repeats is None:
+        data.extend(store.select(criteria, head - len(data) if head else None))
+      else:
+        data.extend(itertools.islice(
+          itertools.ifilter(repeats.accepts, store.select(criteria)),
+          head - len(data) if head else None
+        ))
+    except sqlite3.Error as e:
+      raise BpdiagError("can't read from '{}': {}".format(filename, e))
+  if sample is not None:
+    return sample.values
+  return data
 
 
 def output_chart(
   stats, filename='bpdiag.svg', png=False, light=False,
   width=False, height=False,
-  dots=True, lines=True, fill=False
+  dots=True, lines=True, fill=False, rolling=False, derived=False
 ):
   """
   Generate a line-chart from *stats*.
@@ -436,6 +2035,11 @@ def output_chart(
   values are connected by lines. And if *fill* is set, the area between the
   floor and the lines is filled with the same color as the line.
 
+  If *rolling* is set, the rolling averages from the *rolling* attribute of
+  *stats* (see :meth:`Statistic.evaluate_rolling`) are drawn as extra lines.
+  If *derived* is set, the pulse pressure and mean arterial pressure are
+  drawn too.
+
   """
   style = LightStyle if light else DarkStyle
   options = {'show_dots': dots, 'stroke': lines, 'fill': fill, 'style': style}
@@ -447,6 +2051,15 @@ def output_chart(
   chart.add('sys', stats.sys)
   chart.add('dia', stats.dia)
   chart.add('pulse', stats.pulse)
+  if derived:
+    chart.add('pp', stats.pp)
+    chart.add('map', stats.map)
+  if rolling and getattr(stats, 'rolling', None):
+    for attr in STAT_FIELDS:
+      chart.add(
+        '{} ({}d avg)'.format(attr, stats.rolling['window']),
+        stats.rolling[attr + '_avg']
+      )
   if png:
     if filename.endswith('.svg'):
       filename = filename[:-4] + '.png'
@@ -456,22 +2069,106 @@ def output_chart(
   return filename
 
 
-def get_argument_parser():
-  """Return an ``ArgumentsParser`` instance."""
-  ap = argparse.ArgumentParser(
-    description=__doc__.split('\n\n')[1],
-    usage="%(prog)s [OPTIONS] [OUTPUT [OUTPUT OPTIONS]].. [PARSER [PARSER OPTIONS]] FILENAME..",
+def add_json_arguments(ap):
+  """Add the options governing the JSON dumps to the ``ArgumentsParser`` *ap*."""
+  g_json = ap.add_argument_group('json options')
+  g_json.add_argument(
+    '--indent', type=int, metavar='INT', default=None,
+    help="set the number of spaces used as indent; 0 = newline (default: none)"
+  )
+  g_json.add_argument(
+    '--compact', action='store_const', dest='separators',
+    const=(',', ':'), default=(', ', ': '),
+    help="skip empty spaces after `,` and `:`"
   )
-  # positionals
+  g_json.add_argument(
+    '--sort', action='store_true',
+    help="sort JSON dicts by key"
+  )
+  return g_json
+
+
+def add_filter_arguments(ap, dedupe=False):
+  """
+  Add the options for the :cls:`Criteria` to the ``ArgumentsParser`` *ap*.
+  With *dedupe*, the options for the :cls:`Repeats` are added too.
+
+  """
+  g_filter = ap.add_argument_group(
+    'filter',
+    "Only readings matching all given filters are kept. They are applied by "
+    "the parsers, as soon as possible."
+  )
+  g_filter.add_argument(
+    '--from', dest='date_from', type=parse_day, metavar='DATE',
+    help="skip readings before DATE (YYYY-MM-DD)"
+  )
+  g_filter.add_argument(
+    '--to', dest='date_to', type=parse_day, metavar='DATE',
+    help="skip readings after DATE (YYYY-MM-DD)"
+  )
+  for attr in STAT_FIELDS:
+    g_filter.add_argument(
+      '--{}-range'.format(attr), type=parse_range, metavar='MIN:MAX',
+      help="skip readings with {} values out of range".format(attr.upper())
+    )
+  if dedupe:
+    g_filter.add_argument(
+      '--dedupe', action='store_true',
+      help="drop repeated readings, eg. from overlapping exports"
+    )
+    g_filter.add_argument(
+      '--dedupe-keys', type=parse_keys, metavar='ATTR,..',
+      help="compare readings by these attributes; implies `--dedupe` "
+      "(default: '{}')".format(','.join(DEDUPE_KEYS))
+    )
+  return g_filter
+
+
+def add_input_arguments(ap):
+  """
+  Add the positionals (parser and filenames) and the options for reading the
+  input to the ``ArgumentsParser`` *ap*.
+
+  """
   ap.add_argument(
     'parser', choices=PARSERS.keys(), nargs='?', default='plain',
     help="select the parser to use (default: %(default)s)"
   )
   ap.add_argument(
     'filenames', nargs='+', metavar="FILENAME",
-    help="files containing the raw data"
+    help="files containing the raw data; directories and glob patterns "
+    "(eg. 'data/*.txt') are expanded"
+  )
+  g_in = ap.add_argument_group('input')
+  g_in.add_argument(
+    '-r', '--recursive', action='store_true',
+    help="read the files in subdirectories of the given directories too"
+  )
+  g_in.add_argument(
+    '--prefetch', type=int, metavar='INT', default=0,
+    help="read files ahead with INT threads, eg. for lots of small files on "
+    "network storage; 0 = off (default: '%(default)s')"
+  )
+  g_limit = g_in.add_mutually_exclusive_group()
+  g_limit.add_argument(
+    '--head', type=parse_count, metavar='INT', default=0,
+    help="stop reading after INT readings; 0 = off (default: '%(default)s')"
+  )
+  g_limit.add_argument(
+    '--sample', type=parse_count, metavar='INT', default=0,
+    help="keep a uniform random sample of INT readings from all input; 0 = "
+    "off, not with `--align-lines` (default: '%(default)s')"
+  )
+  g_in.add_argument(
+    '--seed', type=int, metavar='INT',
+    help="seed for `--sample`, to get the same sample for the same input"
   )
-  # options
+  return g_in
+
+
+def add_check_arguments(ap):
+  """Add the options for parsing errors to the ``ArgumentsParser`` *ap*."""
   g_check = ap.add_mutually_exclusive_group()
   g_check.add_argument(
     '-N', '--check', dest='check', action='store_true', default=False,
@@ -481,6 +2178,99 @@ def get_argument_parser():
     '-n', '--no-check', dest='check', action='store_const', default=False, const=None,
     help="ignore all parsing errors"
   )
+  ap.add_argument(
+    '-E', '--max-errors', metavar='INT', type=int, default=0,
+    help="don't break on parsing errors, but log them and report the first "
+    "INT ones at the end; 0 = off (default: '%(default)s')"
+  )
+  return g_check
+
+
+def add_parser_arguments(ap):
+  """Add the options of the parsers to the ``ArgumentsParser`` *ap*."""
+  # parser :: plain
+  g_p_plain = ap.add_argument_group(
+    '[PARSER] plain',
+    "Each line of a file is parsed for one or more SYS, DIA and PULSE value(s). "
+    "A *separator* and a *delimiter* are used for that. The *separator* "
+    "separates the three values and the *delimiter* multiple entires on a line."
+  )
+  g_p_plain.add_argument(
+    '-a', '--align-lines', action='store_true',
+    help="keep entries one one line together as a list"
+  )
+  g_p_plain.add_argument(
+    '-k', '--keep-empty-lines', action='store_true',
+    help="keep empty lines as an empty list"
+  )
+  g_p_plain.add_argument(
+    '-e', '--entries', metavar='INT', type=int, default=0,
+    help="number of measures per line; 0 = all (default: '%(default)s')"
+  )
+  g_p_plain.add_argument(
+    '--skip', metavar='STRING', default='-',
+    help="denotes skipped values (default: '%(default)s')"
+  )
+  g_p_plain.add_argument(
+    '--delimiter', metavar='STRING', default=',',
+    help="splits multiple measures on one line; for the csv parser, the "
+    "fields of a row (default: '%(default)s')"
+  )
+  g_p_plain.add_argument(
+    '--separator', metavar='STRING', default='/',
+    help="splits measure string to sys/dia/pulse values (default: '%(default)s')"
+  )
+  # parser :: regex
+  g_p_regex = ap.add_argument_group(
+    '[PARSER] regex',
+    "Each line of a file is parsed with the given *regular expression*. Every "
+    "named group becomes an attribute of the resulting *Measurement* instance. "
+    "A named group looks like this: `(?P<name-of-the-grp>)`, and you need at "
+    "least a group for SYS, DIA and PULSE."
+  )
+  g_p_regex.add_argument(
+    '--regex', metavar='REGEX', default=PARSERS['regex']['def_regex'],
+    help="regex to use (default: '%(default)s')"
+  )
+  # parser :: csv
+  g_p_csv = ap.add_argument_group(
+    '[PARSER] csv',
+    "Each row of a file is parsed as CSV, with fields separated by "
+    "*delimiter*. The first row needs to be a header with the names of the "
+    "columns. Columns named like sys, dia, pulse, date or time are used for "
+    "those attributes; you can map other columns too."
+  )
+  g_p_csv.add_argument(
+    '--columns', metavar='ATTR=COLUMN,..', type=parse_columns,
+    help="map the given columns to attributes, eg: 'sys=Systolic,dia=Diastolic'"
+  )
+  # parser :: json
+  g_p_json = ap.add_argument_group(
+    '[PARSER] json',
+    "Parses one JSON array from all given files. Note: this might not work "
+    "well with multiple JSON objects. Each entry in the array needs to be an "
+    "array with three values for SYS, DIA and PULSE."
+  )
+  g_p_json.add_argument(
+    '--as-obj', action='store_true',
+    help="entries are JSON objects instead of arrays"
+  )
+
+
+def get_argument_parser():
+  """Return an ``ArgumentsParser`` instance."""
+  ap = argparse.ArgumentParser(
+    description=__doc__.split('\n\n')[1],
+    usage="%(prog)s [OPTIONS] [OUTPUT [OUTPUT OPTIONS]].. [PARSER [PARSER OPTIONS]] FILENAME..",
+    epilog="To merge partial statistics (see `--json-partial`) from several "
+    "runs into one, use: %(prog)s merge FILENAME.. -- To store readings in a "
+    "SQLite database use: %(prog)s ingest --db DATABASE [PARSER] FILENAME.. "
+    "and to query it: %(prog)s query DATABASE",
+  )
+  # positionals, input, checks and filter
+  add_input_arguments(ap)
+  add_check_arguments(ap)
+  add_filter_arguments(ap, dedupe=True)
   # output
   g_out = ap.add_argument_group('output')
   g_out.add_argument(
@@ -499,6 +2289,32 @@ def get_argument_parser():
     '--json-stats', action='store_true',
     help="export statistics to JSON as object"
   )
+  g_out.add_argument(
+    '--json-partial', action='store_true',
+    help="export mergeable partial statistics to JSON as object"
+  )
+  g_out.add_argument(
+    '-o', '--output', type=parse_outputs, metavar='OUTPUT=FILENAME,..',
+    default={},
+    help="write the given JSON outputs to files instead of STDOUT (implies "
+    "them), eg: 'json=data.json,json-stats=stats.json'; OUTPUT is one of: "
+    "{}".format(', '.join(JSON_OUTPUTS))
+  )
+  g_out.add_argument(
+    '--rolling', type=int, metavar='DAYS',
+    help="add rolling min, max and avg values over DAYS to the statistics"
+  )
+  g_out.add_argument(
+    '--group-by', metavar='KEY',
+    help="add statistics per group to the report and the statistics; KEY is "
+    "'file', 'line' or the name of an attribute (eg. a regex group)"
+  )
+  g_out.add_argument(
+    '--provenance', action='store_true',
+    help="record file and line of each reading; they are added to the "
+    "`--json-obj` export and the locations of the min / max values are "
+    "reported (not for the json and sqlite parsers)"
+  )
   # charts
   g_chart = ap.add_argument_group('chart options')
   g_chart.add_argument(
@@ -533,88 +2349,204 @@ def get_argument_parser():
     '--fill', action='store_true',
     help="fill lines"
   )
-  # json
-  g_json = ap.add_argument_group('json options')
-  g_json.add_argument(
-    '--indent', type=int, metavar='INT', default=None,
-    help="set the number of spaces used as indent; 0 = newline (default: none)"
-  )
-  g_json.add_argument(
-    '--compact', action='store_const', dest='separators',
-    const=(',', ':'), default=(', ', ': '),
-    help="skip empty spaces after `,` and `:`"
-  )
-  g_json.add_argument(
-    '--sort', action='store_true',
-    help="sort JSON dicts by key"
-  )
-  # parser :: plain
-  g_p_plain = ap.add_argument_group(
-    '[PARSER] plain',
-    "Each line of a file is parsed for one or more SYS, DIA and PULSE value(s). "
-    "A *separator* and a *delimiter* are used for that. The *separator* "
-    "separates the three values and the *delimiter* multiple entires on a line."
-  )
-  g_p_plain.add_argument(
-    '-a', '--align-lines', action='store_true',
-    help="keep entries one one line together as a list"
+  g_chart.add_argument(
+    '--chart-rolling', action='store_true',
+    help="draw the rolling averages too (needs `--rolling`)"
   )
-  g_p_plain.add_argument(
-    '-k', '--keep-empty-lines', action='store_true',
-    help="keep empty lines as an empty list"
+  g_chart.add_argument(
+    '--chart-derived', action='store_true',
+    help="draw the pulse pressure and mean arterial pressure too"
   )
-  g_p_plain.add_argument(
-    '-e', '--entries', metavar='INT', type=int, default=0,
-    help="number of measures per line; 0 = all (default: '%(default)s')"
+  # json
+  add_json_arguments(ap)
+  # parsers
+  add_parser_arguments(ap)
+  return ap
+
+
+def get_merge_argument_parser():
+  """Return an ``ArgumentsParser`` instance for the *merge* command."""
+  ap = argparse.ArgumentParser(
+    prog='bpdiag merge',
+    description="Merge partial statistics (exported with `--json-partial`) "
+    "into one. The merged statistics are printed to STDERR and dumped as "
+    "partial statistic to STDOUT, so they can be merged again.",
   )
-  g_p_plain.add_argument(
-    '--skip', metavar='STRING', default='-',
-    help="denotes skipped values (default: '%(default)s')"
+  ap.add_argument(
+    'filenames', nargs='+', metavar="FILENAME",
+    help="files containing a partial statistic each"
   )
-  g_p_plain.add_argument(
-    '--delimiter', metavar='STRING', default=',',
-    help="splits multiple measures on one line (default: '%(default)s')"
+  add_json_arguments(ap)
+  return ap
+
+
+def get_ingest_argument_parser():
+  """Return an ``ArgumentsParser`` instance for the *ingest* command."""
+  ap = argparse.ArgumentParser(
+    prog='bpdiag ingest',
+    usage="%(prog)s --db DATABASE [OPTIONS] [PARSER [PARSER OPTIONS]] FILENAME..",
+    description="Parse the given files and store the readings in a SQLite "
+    "database. Read them back with the `sqlite` parser, or get statistics "
+    "directly from the database with `bpdiag query`.",
   )
-  g_p_plain.add_argument(
-    '--separator', metavar='STRING', default='/',
-    help="splits measure string to sys/dia/pulse values (default: '%(default)s')"
+  ap.add_argument(
+    '--db', required=True, metavar='DATABASE',
+    help="SQLite database to store the readings in (created if missing)"
   )
-  # parser :: regex
-  g_p_regex = ap.add_argument_group(
-    '[PARSER] regex',
-    "Each line of a file is parsed with the given *regular expression*. Every "
-    "named group becomes an attribute of the resulting *Measurement* instance. "
-    "A named group looks like this: `(?P<name-of-the-grp>)`, and you need at "
-    "least a group for SYS, DIA and PULSE."
+  ap.add_argument(
+    '--batch', type=int, metavar='INT', default=1000,
+    help="readings inserted per transaction (default: '%(default)s')"
   )
-  g_p_regex.add_argument(
-    '--regex', metavar='REGEX', default=PARSERS['regex']['def_regex'],
-    help="regex to use (default: '%(default)s')"
+  add_input_arguments(ap)
+  add_check_arguments(ap)
+  add_filter_arguments(ap, dedupe=True)
+  add_parser_arguments(ap)
+  return ap
+
+
+def get_query_argument_parser():
+  """Return an ``ArgumentsParser`` instance for the *query* command."""
+  ap = argparse.ArgumentParser(
+    prog='bpdiag query',
+    description="Calculate statistics over the readings stored in a SQLite "
+    "database (see `bpdiag ingest`). The statistics are printed to STDERR and "
+    "dumped as partial statistic (see `--json-partial`) to STDOUT.",
   )
-  # parser :: json
-  g_p_json = ap.add_argument_group(
-    '[PARSER] json',
-    "Parses one JSON array from all given files. Note: this might not work "
-    "well with multiple JSON objects. Each entry in the array needs to be an "
-    "array with three values for SYS, DIA and PULSE."
+  ap.add_argument(
+    'db', metavar='DATABASE',
+    help="SQLite database containing the readings"
   )
-  g_p_json.add_argument(
-    '--as-obj', action='store_true',
-    help="entries are JSON objects instead of arrays"
+  ap.add_argument(
+    '--buckets', choices=sorted(BUCKETS), metavar='PERIOD',
+    help="dump statistics for each {} instead".format(', '.join(sorted(BUCKETS)))
   )
+  add_filter_arguments(ap)
+  add_json_arguments(ap)
   return ap
 
 
-def read_files(filenames):
-  """Generator that yields every line of each file in *filenames*."""
-  for filename in filenames:
-    try:
-      with open(filename) as fh:
-        for line in fh:
-          yield line
-    except IOError:
-      print >> sys.stderr, "[WARN]: Can't read from '{}'".format(filename)
+def expand_filenames(names, recursive=False):
+  """
+  Return a list of filenames: each entry of *names* that is a directory is
+  replaced by the files in it (and in all its subdirectories, if *recursive*
+  is set), each glob pattern by the matching files (both sorted). Like glob
+  does, hidden files (and directories) are skipped. Other entries are kept as
+  they are.
+
+  A directory or glob pattern without any files is warned about, like a
+  missing file (see :func:`read_files`).
+
+  """
+  filenames = []
+  for name in names:
+    count = len(filenames)
+    if os.path.isdir(name):
+      if recursive:
+        for path, dirnames, files in os.walk(name):
+          dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+          filenames.extend(
+            os.path.join(path, fn) for fn in sorted(files)
+            if not fn.startswith('.')
+          )
+      else:
+        filenames.extend(
+          path for path in (
+            os.path.join(name, fn) for fn in sorted(os.listdir(name))
+            if not fn.startswith('.')
+          ) if os.path.isfile(path)
+        )
+    elif glob.has_magic(name):
+      for path in sorted(glob.glob(name)):
+        if os.path.isdir(path):
+          filenames.extend(expand_filenames([path], recursive))
+        else:
+          filenames.append(path)
+    else:
+      filenames.append(name)
       continue
+    if len(filenames) == count:
+      print >> sys.stderr, "[WARN]: Can't read from '{}'".format(name)
+  return filenames
+
+
+def read_file(filename):
+  """Return the content of *filename* (or the ``IOError`` raised reading it)."""
+  try:
+    with open(filename) as fh:
+      return fh.read()
+  except IOError as e:
+    return e
+
+
+def prefetch_files(filenames, workers, buffer=None):
+  """
+  Generator that yields the content of each file in *filenames* (see
+  :func:`read_file`), in order.
+
+  The files are read concurrently by a pool of *workers* threads, but at most
+  *buffer* (default: twice the *workers*) files are read ahead.
+
+  """
+  slots = threading.Semaphore(buffer or workers * 2)
+  stop = threading.Event()
+
+  def tasks():
+    for filename in filenames:
+      slots.acquire()
+      if stop.is_set():
+        return
+      yield filename
+
+  pool = ThreadPool(workers)
+  try:
+    for content in pool.imap(read_file, tasks()):
+      slots.release()
+      yield content
+  finally:
+    # wake up the task feeder, if it waits for a free slot
+    stop.set()
+    slots.release()
+    pool.terminate()
+
+
+def read_files(filenames, position=None, prefetch=0):
+  """
+  Generator that yields every line of each file in *filenames*.
+
+  If *position* is set to an :cls:`InputPosition` instance, it's updated with
+  the file index and line number of each line before it is yielded.
+
+  If *prefetch* is set to a value greater than 0, that much threads read the
+  files ahead (see :func:`prefetch_files`). The lines are still yielded in
+  the order of *filenames*.
+
+  """
+  contents = prefetch_files(filenames, prefetch) if prefetch > 0 else None
+  try:
+    for index, filename in enumerate(filenames):
+      try:
+        if contents is None:
+          fh = open(filename)
+        else:
+          content = next(contents)
+          if isinstance(content, IOError):
+            raise content
+          fh = io.BytesIO(content)
+        with fh:
+          if position is None:
+            for line in fh:
+              yield line
+          else:
+            position.file = index
+            for lineno, line in enumerate(fh, 1):
+              position.line = lineno
+              yield line
+      except IOError:
+        print >> sys.stderr, "[WARN]: Can't read from '{}'".format(filename)
+        continue
+  finally:
+    if contents is not None:
+      contents.close()
 
 
 def parse_data(lines, args):
@@ -635,6 +2567,93 @@ def parse_data(lines, args):
   return func(lines, **kwargs)
 
 
+def parse_outputs(string):
+  """
+  Return a dictionary parsed from a comma separated list of
+  ``output=filename`` pairs, eg: ``json=data.json,json-stats=stats.json``.
+
+  """
+  try:
+    outputs = dict(
+      (output.strip().lower(), filename.strip())
+      for output, filename in (pair.split('=', 1) for pair in string.split(','))
+    )
+  except ValueError:
+    raise argparse.ArgumentTypeError(
+      "needs to be a comma separated list of OUTPUT=FILENAME pairs"
+    )
+  unknown = [output for output in outputs if output not in JSON_OUTPUTS]
+  if unknown:
+    raise argparse.ArgumentTypeError(
+      "unknown output(s): {} (use: {})".format(
+        ', '.join(sorted(unknown)), ', '.join(JSON_OUTPUTS)
+      )
+    )
+  return outputs
+
+
+def parse_keys(string):
+  """Return a tuple of attribute names parsed from a comma separated list."""
+  keys = tuple(key.strip().lower() for key in string.split(',') if key.strip())
+  if not keys:
+    raise argparse.ArgumentTypeError("needs at least one attribute name")
+  return keys
+
+
+def get_criteria(args):
+  """
+  Return a :cls:`Criteria` instance build from the filter options in *args*,
+  or ``None`` if none is set.
+
+  """
+  if args.date_from or args.date_to or any(
+    getattr(args, attr + '_range') for attr in STAT_FIELDS
+  ):
+    return Criteria(
+      args.date_from, args.date_to,
+      args.sys_range, args.dia_range, args.pulse_range
+    )
+  return None
+
+
+def get_repeats(args):
+  """
+  Return a :cls:`Repeats` instance build from the dedupe options in *args*,
+  or ``None`` if none is set.
+
+  """
+  if args.dedupe or args.dedupe_keys:
+    return Repeats(args.dedupe_keys or DEDUPE_KEYS)
+  return None
+
+
+def get_timestamps(args):
+  """
+  Return a :cls:`Timestamps` instance, if the parser in *args* records them,
+  or ``None``.
+
+  """
+  if 'timestamps' in PARSERS[args.parser]['args']:
+    return Timestamps()
+  return None
+
+
+def get_sample(args, provenance=None, timestamps=None):
+  """
+  Return a :cls:`Reservoir` instance build from the sample options in *args*,
+  or ``None`` if none is set.
+
+  The :cls:`Provenance` instance *provenance* (if the parser records it) and
+  the :cls:`Timestamps` instance *timestamps* are kept in sync by the sample.
+
+  """
+  if args.sample <= 0:
+    return None
+  if 'provenance' not in PARSERS[args.parser]['args']:
+    provenance = None
+  return Reservoir(args.sample, args.seed, provenance, timestamps)
+
+
 def stats_as_string(stats):
   """Return a string containing the info from *stats*."""
   statstr =\
@@ -645,6 +2664,40 @@ def stats_as_string(stats):
   return statstr.format(stats)
 
 
+def groups_as_string(stats, key):
+  """
+  Return a string containing the per group info from *stats* (see
+  :meth:`Statistic.evaluate_groups`).
+
+  """
+  lines = ["Statistics by {} (count; min, max, avg):".format(key)]
+  for group, values in stats.groups.items():
+    lines.append(":: {}: {}".format(group, values['count']))
+    for attr in STAT_FIELDS:
+      lines.append("   {:.<6}: {:3}, {:3}, {:3}".format(
+        attr.upper(), values[attr + '_min'], values[attr + '_max'],
+        values[attr + '_avg']
+      ))
+  return "\n".join(lines)
+
+
+def locations_as_string(stats, provenance):
+  """
+  Return a string containing the locations of the min / max values from
+  *stats* (see :cls:`Provenance`).
+
+  """
+  lines = ["Locations (min, max):"]
+  for attr in STAT_FIELDS:
+    values = getattr(stats, attr)
+    lines.append(":: {:.<6}: {}, {}".format(
+      attr.upper(),
+      provenance.location(values.index(getattr(stats, attr + '_min'))),
+      provenance.location(values.index(getattr(stats, attr + '_max')))
+    ))
+  return "\n".join(lines)
+
+
 def main(args=None):
   """
   Read from all given *filenames*, use the specified *parser*, generate
@@ -653,55 +2706,140 @@ def main(args=None):
   All arguments are parsed from **args**. If *args* is ``None``, ``sys.argv``
   is used (the command line).
 
+  If the first argument is the name of a command from the global
+  **COMMANDS** dictionary, the rest of the arguments are handed to the
+  function registered for it instead.
+
   """
+  if args is None:
+    args = sys.argv[1:]
+  if args and args[0] in COMMANDS:
+    return globals()[COMMANDS[args[0]]](args[1:])
+  position = InputPosition()
   try:
     # parse command line
-    args = get_argument_parser().parse_args(args)
+    ap = get_argument_parser()
+    args = ap.parse_args(args)
+    if args.group_by in ('file', 'line') and (
+      'provenance' not in PARSERS[args.parser]['args']
+    ):
+      ap.error(
+        "argument --group-by: grouping by {} needs the position of the "
+        "readings, not recorded by the {} parser".format(
+          args.group_by, args.parser
+        )
+      )
+    if args.sample and args.align_lines and (
+      'align_lines' in PARSERS[args.parser]['args']
+    ):
+      ap.error("argument --sample: aligned lines can't be sampled")
+    if args.provenance:
+      if 'provenance' not in PARSERS[args.parser]['args']:
+        ap.error(
+          "argument --provenance: the position of the readings isn't "
+          "recorded by the {} parser".format(args.parser)
+        )
+      # the exports add file and line as attributes of the readings
+      if args.parser == 'regex':
+        names = re.compile(args.regex).groupindex
+      elif args.parser == 'csv':
+        names = args.columns or {}
+      else:
+        names = {}
+      if 'file' in names or 'line' in names:
+        ap.error(
+          "argument --provenance: the readings have their own file or line "
+          "attribute"
+        )
+    args.filenames = expand_filenames(args.filenames, args.recursive)
+    if args.max_errors > 0:
+      args.errors = ErrorLog(args.max_errors, args.filenames, position)
+    else:
+      args.errors = None
+    args.criteria = get_criteria(args)
+    args.repeats = get_repeats(args)
+    args.position = position
+    # grouping by position needs provenance, but doesn't report it
+    report_provenance = args.provenance
+    if args.provenance or args.group_by in ('file', 'line'):
+      args.provenance = Provenance(args.filenames, position)
+    else:
+      args.provenance = None
+    args.timestamps = get_timestamps(args)
+    args.sample = get_sample(args, args.provenance, args.timestamps)
     # parse data from all given files (iterative) and build statistics
-    stats = Statistic(parse_data(read_files(args.filenames), args))
+    data = parse_data(
+      read_files(args.filenames, position, args.prefetch), args
+    )
+    stats = Statistic(data, args.timestamps)
+    # only use complete provenance data (not all parsers record it)
+    if args.provenance is not None and len(args.provenance) == len(stats):
+      provenance = args.provenance
+    else:
+      provenance = None
     print >> sys.stderr, "Parsed {} values ({} skipped)...".format(
       len(stats), stats.skipped
     )
+    if args.sample:
+      print >> sys.stderr, "Sampled from {} values.".format(args.sample.seen)
+    if args.repeats:
+      print >> sys.stderr, "Dropped {} repeated values.".format(
+        args.repeats.dropped
+      )
+    if args.criteria:
+      print >> sys.stderr, "Filtered out {} values.".format(
+        args.criteria.rejected
+      )
+    if args.errors:
+      print >> sys.stderr, "[WARN]:", args.errors.summary()
     if stats:
       print >> sys.stderr, stats_as_string(stats)
+      if provenance and report_provenance:
+        print >> sys.stderr, locations_as_string(stats, provenance)
     else:
       print >> sys.stderr, "Sorry, no values found."
       return RETURN_CODES['error_input_nothing_found']
+    if args.group_by:
+      stats.evaluate_groups(args.group_by, provenance)
+      print >> sys.stderr, groups_as_string(stats, args.group_by)
+    if args.rolling:
+      stats.evaluate_rolling(args.rolling)
     # output: do some stuff
-    if args.json:
-      if stats.is_list:
-        dump = [[m.as_tuple() if m else None for m in l] for l in stats.data]
-      else:
-        dump = [m.as_tuple() if m else None for m in stats.data]
-      print json.dumps(
-        dump,
-        indent=args.indent, separators=args.separators, sort_keys=args.sort
-      ), "\n\n"
-    if args.json_obj:
-      if stats.is_list:
-        dump = [[m.as_dict() if m else None for m in l] for l in stats.data]
-      else:
-        dump = [m.as_dict() if m else None for m in stats.data]
-      print json.dumps(
-        dump,
-        indent=args.indent, separators=args.separators, sort_keys=args.sort
-      ), "\n\n"
-    if args.json_stats:
-      print json.dumps(
-        stats.as_dict(),
-        indent=args.indent, separators=args.separators, sort_keys=args.sort
-      ), "\n\n"
+    exporter = Exporter(
+      stats, provenance if report_provenance else None,
+      args.indent, args.separators, args.sort
+    )
+    for kind in JSON_OUTPUTS:
+      if kind in args.output or getattr(args, kind.replace('-', '_')):
+        exporter.add_json(kind, args.output.get(kind))
     if args.chart:
-      fn = output_chart(
+      exporter.add_task(
+        output_chart,
         stats, args.filename, args.png, args.light,
         args.width, args.height,
-        not args.no_dots, not args.no_lines, args.fill
+        not args.no_dots, not args.no_lines, args.fill,
+        args.chart_rolling, args.chart_derived
       )
-      print >> sys.stderr, "Generated chart: '{}'".format(fn)
+    results = exporter.run()
+    for (kind, filename), result in zip(exporter.dumps, results):
+      if result is not None:
+        print >> sys.stderr, "Exported {}: '{}'".format(kind, result)
+    if args.chart:
+      print >> sys.stderr, "Generated chart: '{}'".format(results[-1])
   except BpdiagError as e:
-    print >> sys.stderr,\
-      "[ERROR] while parsing:", e
+    if position.file is None:
+      print >> sys.stderr,\
+        "[ERROR] while parsing:", e
+    else:
+      print >> sys.stderr,\
+        "[ERROR] while parsing '{}' (line {}):".format(
+          args.filenames[position.file], position.line
+        ), e
     return RETURN_CODES['error_input_parsing']
+  except IOError as e:
+    print >> sys.stderr,\
+      "[ERROR] while writing:", e
+    return RETURN_CODES['error_output']
   except NameError:
     print >> sys.stderr,\
       "[ERROR] For chart export you need to have PyGal installed."
@@ -713,5 +2851,152 @@ def main(args=None):
   return RETURN_CODES['okay']
 
 
+def main_merge(args=None):
+  """
+  Merge the partial statistics from all given *filenames* and print the
+  results.
+
+  All arguments are parsed from **args** (see :func:`main`).
+
+  """
+  try:
+    args = get_merge_argument_parser().parse_args(args)
+    stats = Statistic([])
+    for filename in args.filenames:
+      content = ''.join(read_files([filename]))
+      if not content.strip():
+        # unreadable files are already reported by `read_files`
+        if os.path.isfile(filename):
+          print >> sys.stderr,\
+            "[WARN]: No partial statistic in '{}', skipped".format(filename)
+        continue
+      try:
+        partial = json.loads(content)
+      except ValueError as e:
+        raise BpdiagError("can't load '{}': {}".format(filename, e))
+      stats.update(partial)
+    print >> sys.stderr, "Merged {} values ({} skipped)...".format(
+      len(stats), stats.skipped
+    )
+    if stats:
+      print >> sys.stderr, stats_as_string(stats)
+    else:
+      print >> sys.stderr, "Sorry, no values found."
+      return RETURN_CODES['error_input_nothing_found']
+    print json.dumps(
+      stats.as_partial(),
+      indent=args.indent, separators=args.separators, sort_keys=args.sort
+    )
+  except BpdiagError as e:
+    print >> sys.stderr,\
+      "[ERROR] while merging:", e
+    return RETURN_CODES['error_input_parsing']
+  return RETURN_CODES['okay']
+
+
+def main_ingest(args=None):
+  """
+  Read from all given *filenames*, use the specified *parser* and store the
+  readings in the given SQLite database.
+
+  All arguments are parsed from **args** (see :func:`main`).
+
+  """
+  position = InputPosition()
+  try:
+    ap = get_ingest_argument_parser()
+    args = ap.parse_args(args)
+    if args.sample and args.align_lines and (
+      'align_lines' in PARSERS[args.parser]['args']
+    ):
+      ap.error("argument --sample: aligned lines can't be sampled")
+    args.filenames = expand_filenames(args.filenames, args.recursive)
+    if args.max_errors > 0:
+      args.errors = ErrorLog(args.max_errors, args.filenames, position)
+    else:
+      args.errors = None
+    args.criteria = get_criteria(args)
+    args.repeats = get_repeats(args)
+    args.position = position
+    args.timestamps = get_timestamps(args)
+    args.sample = get_sample(args, timestamps=args.timestamps)
+    data = parse_data(
+      read_files(args.filenames, position, args.prefetch), args
+    )
+    store = Store(args.db, create=True)
+    count = store.ingest(
+      data, args.batch, args.timestamps,
+      args.repeats.keys if args.repeats else None
+    )
+    print >> sys.stderr, "Stored {} values in '{}'...".format(count, args.db)
+    if args.repeats:
+      # readings already stored by an earlier run are repeated too
+      readings = data.values if isinstance(data, AlignedData) else data
+      args.repeats.dropped += len(readings) - readings.count(None) - count
+      print >> sys.stderr, "Dropped {} repeated values.".format(
+        args.repeats.dropped
+      )
+    if args.errors:
+      print >> sys.stderr, "[WARN]:", args.errors.summary()
+    stats = Statistic.from_partial(store.partial())
+    print >> sys.stderr, "Now storing {} values.".format(len(stats))
+    if stats:
+      print >> sys.stderr, stats_as_string(stats)
+  except BpdiagError as e:
+    if position.file is None:
+      print >> sys.stderr,\
+        "[ERROR] while parsing:", e
+    else:
+      print >> sys.stderr,\
+        "[ERROR] while parsing '{}' (line {}):".format(
+          args.filenames[position.file], position.line
+        ), e
+    return RETURN_CODES['error_input_parsing']
+  except sqlite3.Error as e:
+    print >> sys.stderr,\
+      "[ERROR] while storing:", e
+    return RETURN_CODES['error_storage']
+  return RETURN_CODES['okay']
+
+
+def main_query(args=None):
+  """
+  Print statistics over the readings stored in the given SQLite database.
+
+  All arguments are parsed from **args** (see :func:`main`).
+
+  """
+  try:
+    args = get_query_argument_parser().parse_args(args)
+    if not os.path.isfile(args.db):
+      raise BpdiagError("can't read from '{}'".format(args.db))
+    store = Store(args.db)
+    criteria = get_criteria(args)
+    stats = Statistic.from_partial(store.partial(criteria))
+    print >> sys.stderr, "Selected {} values...".format(len(stats))
+    if stats:
+      print >> sys.stderr, stats_as_string(stats)
+    else:
+      print >> sys.stderr, "Sorry, no values found."
+      return RETURN_CODES['error_input_nothing_found']
+    if args.buckets:
+      dump = store.buckets(args.buckets, criteria)
+    else:
+      dump = stats.as_partial()
+    print json.dumps(
+      dump,
+      indent=args.indent, separators=args.separators, sort_keys=args.sort
+    )
+  except BpdiagError as e:
+    print >> sys.stderr,\
+      "[ERROR] while querying:", e
+    return RETURN_CODES['error_input_parsing']
+  except sqlite3.Error as e:
+    print >> sys.stderr,\
+      "[ERROR] while querying:", e
+    return RETURN_CODES['error_storage']
+  return RETURN_CODES['okay']
+
+
 if __name__ == '__main__':
   sys.exit(main())
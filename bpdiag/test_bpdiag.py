@@ -1,15 +1,19 @@
 # -*- coding: UTF-8 -*-
 
 import json
+import os
+import shutil
+import tempfile
 
 
-from nose.tools import assert_equal, assert_raises
+from nose.tools import assert_equal, assert_almost_equal, assert_raises
 
 
 from bpdiag import (
-  BpdiagError,
-  Measurement, Statistic,
-  parse_plaintext, parse_json, parse_regex
+  AlignedData, BpdiagError, Criteria, ErrorLog, Exporter, InputPosition,
+  Measurement, Provenance, Repeats, Reservoir, Statistic, Store, TimeIndex,
+  Timestamps, expand_filenames, read_files, parse_date, get_timestamp,
+  parse_plaintext, parse_json, parse_regex, parse_csv, parse_sqlite
 )
 
 
@@ -84,6 +88,236 @@ def test_statistics():
     assert_equal(d1[attr], d2[attr])
 
 
+def test_partial_statistics():
+  # test exporting and merging of partial statistics
+  values = (
+    (123, 83, 65), (132, 86, 72), (141, 91, 80), (118, 79, 61), (127, 82, 70)
+  )
+  data = [Measurement(*args) for args in values]
+  data.insert(2, None)
+  full = Statistic(data)
+  # ### merge shards (over JSON) and compare with the full statistics:
+  merged = Statistic([])
+  for shard in (data[:2], data[2:3], data[3:], []):
+    partial = json.loads(json.dumps(Statistic(shard).as_partial()))
+    merged.update(partial)
+  assert_equal(len(merged), len(full))
+  assert_equal(merged.skipped, full.skipped)
+  assert_partial_equal(merged.as_partial(), full.as_partial())
+  for attr in ('sys', 'dia', 'pulse', 'pp', 'map'):
+    for ending in ('_min', '_max'):
+      assert_equal(getattr(merged, attr + ending), getattr(full, attr + ending))
+    for ending in ('_avg', '_std', '_cv'):
+      assert_almost_equal(
+        getattr(merged, attr + ending), getattr(full, attr + ending)
+      )
+  # + sums stay exact, even if the averages are rounded:
+  assert_equal(merged.as_partial()['sys']['sum'], sum(v[0] for v in values))
+  # ### round trip:
+  stats = Statistic.from_partial(full.as_partial())
+  assert_partial_equal(stats.as_partial(), full.as_partial())
+  assert_equal(stats.data, [])
+  # ### check that invalid partials raise errors:
+  for partial in ({}, {'partial': 1}, {'partial': 2, 'count': 1}, []):
+    with assert_raises(BpdiagError):
+      Statistic([]).update(partial)
+
+
+def test_time_index():
+  day = 86400
+  # build unsorted data (with ``None`` values and readings without date)
+  data = [
+    Measurement(120 + i % 7 * 3, 80 - i % 5, 60 + i % 11, date=date, time=time)
+    for i, (date, time) in enumerate(
+      ('2013-01-{:02}'.format(i % 20 + 1), '{:02}:00'.format(i % 24))
+      for i in range(47, 0, -1)
+    )
+  ]
+  data.insert(3, None)
+  data.insert(7, Measurement(140, 90, 70))
+  m = Measurement(120, 80, 60, date='1970-01-02', time='01:30')
+  assert_equal(get_timestamp(m), day + 5400)
+  assert_equal(get_timestamp(data[7]), None)
+  index = TimeIndex(data)
+  assert_equal(len(index), len(data) - 2)
+  assert_equal(list(index.stamps), sorted(index.stamps))
+  # ### range lookups:
+  start, end = parse_date('2013-01-05'), parse_date('2013-01-08') - 1
+  exp = sorted(
+    (get_timestamp(m), i) for i, m in enumerate(data)
+    if m is not None and get_timestamp(m) is not None and
+    start <= get_timestamp(m) <= end
+  )
+  assert_equal(index.range(start, end), [i for stamp, i in exp])
+  assert_equal(index.range(), list(index.positions))
+  assert_equal(index.range(end=0), [])
+  # ### rolling statistics need to match the naive calculation:
+  values = [m.sys if m else None for m in data]
+  for window in (1, 3 * day, 7 * day):
+    mins, maxs, avgs = index.rolling(values, window)
+    for i, m in enumerate(data):
+      stamp = get_timestamp(m) if m is not None else None
+      if stamp is None:
+        assert_equal((mins[i], maxs[i], avgs[i]), (None, None, None))
+        continue
+      in_window = [
+        values[j] for j in index.positions
+        if stamp - window < get_timestamp(data[j]) <= stamp
+      ]
+      assert_equal(mins[i], min(in_window))
+      assert_equal(maxs[i], max(in_window))
+      assert_equal(avgs[i], sum(in_window) / len(in_window))
+  # ### readings with the same timestamp get the same results (whatever the
+  #     input order):
+  for order in ((100, 140, 120), (120, 100, 140), (140, 120, 100)):
+    same_day = [Measurement(sys, 80, 60, date='2013-01-02') for sys in order]
+    mins, maxs, avgs = TimeIndex(same_day).rolling(list(order), day)
+    assert_equal(avgs, [120, 120, 120])
+    assert_equal(maxs, [140, 140, 140])
+    assert_equal(mins, [100, 100, 100])
+  # ### available from the statistics:
+  stats = Statistic(data)
+  stats.evaluate_rolling(7)
+  assert_equal(stats.rolling['window'], 7)
+  assert_equal(stats.rolling['sys_avg'], index.rolling(values, 7 * day)[2])
+  assert_equal(len(stats.rolling['pulse_max']), len(stats.pulse))
+  assert 'rolling' in stats.as_dict()
+
+
+def test_timestamps():
+  day = 86400
+  # ### valid dates and times are packed into one integer:
+  timestamps = Timestamps()
+  values = {'date': '1970-01-02', 'time': '01:30', 'x': 'y'}
+  assert_equal(timestamps.pack(values), (day + 5400, 2))
+  assert_equal(values, {'x': 'y'})
+  values = {'date': '1970-1-2', 'time': None}
+  assert_equal(timestamps.pack(values), (day, 1))
+  assert_equal(values, {'time': None})
+  # + invalid strings are kept:
+  values = {'date': '2013-01-23', 'time': '25:00'}
+  assert_equal(timestamps.pack(values), (parse_date('2013-01-23'), 1))
+  assert_equal(values, {'time': '25:00'})
+  for values in ({'date': '2013-02-30', 'time': '10:00'}, {'date': None}, {}):
+    assert_equal(timestamps.pack(dict(values)), (0, 0))
+    assert_equal(timestamps.current, (0, 0))
+  # ### the parsers record them for every entry:
+  lines = ['2013-1-23 08:05 120/80/60', 'xxx', '2013-01-32 120/80/60']
+  timestamps = Timestamps()
+  data = parse_regex(lines, check=None, timestamps=timestamps)
+  assert_equal(len(timestamps), len(data))
+  assert_equal(
+    [timestamps.timestamp(i) for i in range(3)],
+    [parse_date('2013-01-23') + 29100, None, None]
+  )
+  assert not hasattr(data[0], 'date')
+  assert_equal(data[2].date, '2013-01-32')
+  # ### the strings are only rebuild for export:
+  assert_equal(timestamps.restore(0, data[0].as_dict()), {
+    'sys': 120, 'dia': 80, 'pulse': 60, 'date': '2013-01-23', 'time': '08:05'
+  })
+  stats = Statistic(data, timestamps)
+  assert_equal(stats.as_dict()['data'][0]['time'], '08:05')
+  assert_equal(stats.as_dict()['data'][2]['date'], '2013-01-32')
+  assert 'timestamps' not in stats.as_dict()
+  assert_equal(stats.index.range(), [0])
+  timestamps = Timestamps()
+  data = parse_csv(
+    ['sys,dia,pulse,date', '120,80,60,2013-01-23'], timestamps=timestamps
+  )
+  assert_equal(timestamps.restore(0, {})['date'], '2013-01-23')
+  assert_equal(timestamps.get(0), (parse_date('2013-01-23'), 1))
+  # ### repeats and groups are found by the integers:
+  lines = [
+    '2013-1-2 8:00 120/80/60', '2013-01-02 08:00 120/80/60',
+    '2013-01-02 20:00 130/85/70'
+  ]
+  timestamps, repeats = Timestamps(), Repeats()
+  data = parse_regex(lines, repeats=repeats, timestamps=timestamps)
+  assert_equal((len(data), len(timestamps), repeats.dropped), (2, 2, 1))
+  stats = Statistic(data, timestamps)
+  stats.evaluate_groups('date')
+  assert_equal(stats.groups.keys(), ['2013-01-02'])
+  stats.evaluate_groups('time')
+  assert_equal(stats.groups.keys(), ['08:00', '20:00'])
+  # ### the sample keeps them in sync:
+  timestamps = Timestamps()
+  sample = Reservoir(1, seed=1, timestamps=timestamps)
+  data = parse_regex(lines, timestamps=timestamps, sample=sample)
+  assert_equal(len(timestamps), 1)
+  times = {120: '08:00', 130: '20:00'}
+  assert_equal(timestamps.restore(0, {})['time'], times[data[0].sys])
+
+
+def assert_partial_equal(first, second):
+  # compare partial statistics (the floats only almost)
+  assert_equal(sorted(first), sorted(second))
+  for key, value in first.items():
+    if isinstance(value, dict):
+      assert_partial_equal(value, second[key])
+    elif isinstance(value, float):
+      assert_almost_equal(value, second[key])
+    else:
+      assert_equal(value, second[key])
+
+
+def test_variability():
+  values = ((123, 83, 65), (132, 86, 72), (141, 91, 80), (118, 79, 61))
+  data = [Measurement(*args) for args in values]
+  stats = Statistic(data[:2] + [None] + data[2:])
+  # ### derived lists:
+  assert_equal(stats.pp, [40, 46, None, 50, 39])
+  assert_almost_equal(stats.map[0], 83 + 40 / 3.0)
+  assert_equal(stats.map[2], None)
+  assert_equal((stats.pp_min, stats.pp_max), (39, 50))
+  # ### std and cv need to match the naive (two pass) calculation:
+  for attr, column in (
+    ('sys', [v[0] for v in values]), ('pulse', [v[2] for v in values]),
+    ('map', [v[1] + (v[0] - v[1]) / 3.0 for v in values])
+  ):
+    mean = sum(column) / float(len(column))
+    std = (sum((v - mean) ** 2 for v in column) / (len(column) - 1)) ** 0.5
+    assert_almost_equal(getattr(stats, attr + '_std'), std)
+    assert_almost_equal(getattr(stats, attr + '_cv'), 100 * std / mean)
+  # + stable with big offsets too:
+  big = Statistic([Measurement(10 ** 9 + v, 80, 60) for v in (4, 7, 13, 16)])
+  assert_almost_equal(big.sys_std, 30 ** 0.5)
+  # ### not enough values:
+  stats = Statistic(data[:1])
+  assert_equal((stats.sys_std, stats.sys_cv), (None, None))
+  assert 'sys_std' in stats.as_dict()
+
+
+def test_aligned_data():
+  a, b, c = [Measurement(*args) for args in ((1, 2, 3), (4, 5, 6), (7, 8, 9))]
+  lines = [[a, None], [], [b, c]]
+  data = AlignedData(lines)
+  # ### flat values and line offsets:
+  assert_equal(data.values, [a, None, b, c])
+  assert_equal(list(data.offsets), [0, 2, 2, 4])
+  assert_equal(len(data), 3)
+  # ### access per line:
+  assert_equal(list(data), lines)
+  assert_equal((data[0], data[1], data[-1]), (lines[0], [], lines[2]))
+  assert_raises(IndexError, lambda: data[3])
+  assert_equal(list(data.split(range(4))), [[0, 1], [], [2, 3]])
+  # ### ``Statistic`` uses the flat values (and converts lists of lists):
+  for stats in (Statistic(data), Statistic(lines)):
+    assert stats.is_list
+    assert_equal(stats.values, [a, None, b, c])
+    assert_equal(stats.sys, [1, None, 4, 7])
+  # ### dropped repeats keep the lines aligned:
+  repeats = Repeats(('sys', ))
+  data = parse_plaintext(
+    ['1/2/3, 1/2/3', '1/2/3, 4/5/6'], align_lines=True, entries=2,
+    repeats=repeats
+  )
+  assert_equal(
+    ([[m and m.sys for m in line] for line in data], repeats.dropped),
+    ([[1, None], [None, 4]], 2)
+  )
+
+
 def test_parse_plaintext():
   cases = (
     # empty list
@@ -263,3 +497,543 @@ def test_parse_regex():
     for res_measurement, exp_dict in zip(res, exp_dicts):
       for k, v in exp_dict.items():
         assert_equal(getattr(res_measurement, k), v)
+
+
+def test_parse_csv():
+  lines = [
+    'Device,Date,Time,SYS,DIA,Pulse,Note',
+    'A1,2013-01-02,08:12,123,78,65,',
+    '',
+    'A1,2013-01-02,20:01,125,79,68,after walk',
+  ]
+  # ### EMPTY input:
+  assert_equal(parse_csv([]), [])
+  assert_equal(parse_csv(lines[:1]), [])
+  # ### columns are found by name:
+  res = parse_csv(lines)
+  assert_equal([m.as_tuple() for m in res], [(123, 78, 65), (125, 79, 68)])
+  assert_equal(res[0].as_dict(), {
+    'sys': 123, 'dia': 78, 'pulse': 65, 'date': '2013-01-02', 'time': '08:12'
+  })
+  # ### or mapped by *columns*:
+  res = parse_csv(
+    [line.replace('SYS', 'Systolic') for line in lines],
+    columns={'sys': 'Systolic', 'note': 'Note'}
+  )
+  assert_equal(res[1].sys, 125)
+  assert_equal(res[1].note, 'after walk')
+  # ### other delimiters:
+  res = parse_csv([line.replace(',', ';') for line in lines], delimiter=';')
+  assert_equal([m.as_tuple() for m in res], [(123, 78, 65), (125, 79, 68)])
+  # ### check ERROR cases:
+  for header, columns in (
+    ('Date,SYS,DIA', None), ('SYS,DIA,PULSE', {'date': 'Date'})
+  ):
+    with assert_raises(BpdiagError):
+      parse_csv([header, '123,78,65'], columns)
+  broken = lines[:2] + ['A1,2013-01-03', 'A1,2013-01-03,09:00,1x3,78,65,']
+  with assert_raises(BpdiagError):
+    parse_csv(broken)
+  res = parse_csv(broken, check=None)
+  assert_equal(res[1:], [None, None])
+  errors = ErrorLog()
+  res = parse_csv(broken, errors=errors)
+  assert_equal(len(res), 3)
+  assert_equal(len(errors), 2)
+  # ### each file starts with its own header:
+  tmp = tempfile.mkdtemp()
+  try:
+    filenames = [os.path.join(tmp, name) for name in ('a.csv', 'b.csv')]
+    for filename, content in zip(filenames, (
+      lines, ['Pulse,DIA,SYS', '70,80,130']
+    )):
+      with open(filename, 'w') as fh:
+        fh.write('\n'.join(content))
+    position = InputPosition()
+    res = parse_csv(read_files(filenames, position), position=position)
+    assert_equal(
+      [m.as_tuple() for m in res],
+      [(123, 78, 65), (125, 79, 68), (130, 80, 70)]
+    )
+  finally:
+    shutil.rmtree(tmp)
+
+
+def test_criteria():
+  # ### dates:
+  assert_equal(parse_date('1970-01-02'), 86400)
+  assert_equal(parse_date('2013-1-2'), parse_date('2013-01-02'))
+  for date in ('2013-13-01', '2013-01', 'asd'):
+    with assert_raises(ValueError):
+      parse_date(date)
+  with assert_raises(BpdiagError):
+    Criteria(date_from='2013-02-30')
+  lines = [
+    '2013-01-01 08:00 123/78/65', '2013-01-02 124/79/66',
+    '2013-1-3 08:00 125/80/67', '126/81/68', '2013-01-04 08:00 127/82/69'
+  ]
+  criteria = Criteria('2013-01-02', '2013-01-03')
+  res = parse_regex(lines, criteria=criteria)
+  assert_equal([m.sys for m in res], [124, 125])
+  assert_equal(criteria.rejected, 3)
+  criteria = Criteria(date_from='2013-01-03')
+  assert_equal([m.sys for m in parse_regex(lines, criteria=criteria)], [125, 127])
+  # ### values:
+  criteria = Criteria(sys=(None, 125), pulse=(66, None))
+  res = parse_regex(lines, criteria=criteria)
+  assert_equal([m.sys for m in res], [124, 125])
+  res = parse_plaintext(
+    ['123/78/65, 124/79/66', '130/70/70'], criteria=criteria, entries=2
+  )
+  assert_equal([m.sys if m else None for m in res], [None, 124, None, None])
+  res = parse_json('[[123, 78, 65], [124, 79, 66]]', criteria=criteria)
+  assert_equal([m.sys for m in res], [124])
+  csv_lines = ['date,sys,dia,pulse'] + [
+    line.replace(' 08:00', '').replace(' ', ',').replace('/', ',')
+    for line in lines if line.startswith('2013')
+  ]
+  criteria = Criteria('2013-01-02', '2013-01-03', sys=(125, 125))
+  assert_equal([m.sys for m in parse_csv(csv_lines, criteria=criteria)], [125])
+  assert_equal(criteria.rejected, 3)
+  # + readings without date are rejected by a date range, by every parser:
+  criteria = Criteria(date_from='2013-01-01')
+  assert_equal(parse_plaintext(['123/78/65, 124/79/66'], criteria=criteria), [])
+  assert_equal(parse_json('[[123, 78, 65]]', criteria=criteria), [])
+  assert_equal(criteria.rejected, 3)
+
+
+def test_dedupe():
+  week_1 = [
+    '2013-01-01 08:00 123/78/65', '2013-01-01 20:00 124/79/66',
+    '2013-01-02 08:00 125/80/67'
+  ]
+  week_2 = week_1[1:] + ['2013-01-02 20:00 125/80/67', '2013-01-03 126/81/68']
+  # ### parsers drop repeated readings before storing them:
+  repeats = Repeats()
+  res = parse_regex(week_1 + week_2, repeats=repeats)
+  assert_equal([m.sys for m in res], [123, 124, 125, 125, 126])
+  assert_equal(repeats.dropped, 2)
+  assert_equal(parse_regex([], repeats=Repeats()), [])
+  # + with a subset of keys:
+  res = parse_regex(week_1 + week_2, repeats=Repeats(('sys', 'dia', 'pulse')))
+  assert_equal([m.sys for m in res], [123, 124, 125, 126])
+  res = parse_regex(week_1 + week_2, repeats=Repeats(('date', )))
+  assert_equal([m.sys for m in res], [123, 125, 126])
+  # ### ``None`` values are kept and aligned data stays aligned:
+  repeats = Repeats(('sys', 'dia', 'pulse'))
+  res = parse_plaintext(
+    ['123/78/65, -', '123/78/65, 124/79/66', '-, 124/79/66'],
+    align_lines=True, entries=2, repeats=repeats
+  )
+  assert_equal(repeats.dropped, 2)
+  assert_equal(
+    [[m.sys if m else None for m in line] for line in res],
+    [[123, None], [None, 124], [None, None]]
+  )
+  # + so *head* counts unique readings only:
+  res = parse_regex(week_1 + week_2, repeats=Repeats(), head=4)
+  assert_equal([m.sys for m in res], [123, 124, 125, 125])
+  lines = ['sys,dia,pulse', '123,78,65', '123,78,65', '124,79,66']
+  res = parse_csv(lines, repeats=Repeats(), head=2)
+  assert_equal([m.sys for m in res], [123, 124])
+  res = parse_plaintext(
+    ['123/78/65, 123/78/65', '124/79/66'], repeats=Repeats(), entries=2
+  )
+  assert_equal([m.sys if m else None for m in res], [123, None, 124, None])
+  repeats = Repeats(('sys', ))
+  res = parse_json(['[[123, 78, 65], [123, 79, 66]]'], repeats=repeats)
+  assert_equal((len(res), repeats.dropped), (1, 1))
+
+
+def test_error_log():
+  lines = ['136/83/65, 132/82/70', '136/8365', '', '144/e2/86, 1/2, 127/79/72']
+  # ### errors get logged instead of raised:
+  errors = ErrorLog(limit=2)
+  res = parse_plaintext(lines, check=True, errors=errors)
+  assert_equal(
+    [m.as_tuple() for m in res],
+    [(136, 83, 65), (132, 82, 70), (127, 79, 72)]
+  )
+  assert_equal(errors.count, 3)
+  assert_equal(len(errors.errors), 2)
+  assert_equal([e[2] for e in errors.errors], ['136/8365', '144/e2/86'])
+  # + with *entries* ``None`` is stored for each logged entry:
+  errors = ErrorLog()
+  res = parse_plaintext(['1/2/3, x/5/6'], entries=3, check=True, errors=errors)
+  assert_equal([m and m.sys for m in res], [1, None, None])
+  res = parse_plaintext(
+    ['1/2/3, x/5/6'], align_lines=True, entries=3, check=True, errors=errors
+  )
+  assert_equal([[m and m.sys for m in l] for l in res], [[1, None, None]])
+  assert_equal(errors.count, 4)
+  # + but not if *check* is ``None``:
+  errors = ErrorLog()
+  parse_plaintext(lines, check=None, errors=errors)
+  assert_equal(len(errors), 0)
+  # + other parsers:
+  errors = ErrorLog()
+  res = parse_regex(lines, errors=errors)
+  assert_equal(res[1], None)
+  assert_equal(res[2].as_tuple(), (127, 79, 72))
+  assert_equal(len(errors), 1)
+  errors = ErrorLog()
+  assert_equal(parse_json(['[[1, 2'], errors=errors), [])
+  assert_equal(len(errors), 1)
+  # ### file and line numbers are taken from ``read_files``:
+  fd, filename = tempfile.mkstemp()
+  try:
+    with os.fdopen(fd, 'w') as fh:
+      fh.write('\n'.join(lines))
+    position = InputPosition()
+    errors = ErrorLog(filenames=['missing', filename], position=position)
+    parse_plaintext(
+      read_files(errors.filenames, position), check=True, errors=errors
+    )
+  finally:
+    os.remove(filename)
+  assert_equal([e[:2] for e in errors.errors], [(1, 2), (1, 4), (1, 4)])
+  assert_equal(errors.location(1, 2), filename + ':2')
+
+
+def test_store():
+  lines = [
+    '2013-01-01 08:00 123/78/65', '2013-01-01 20:00 131/79/66',
+    '2013-01-02 08:00 125/80/67', '2013-02-01 126/81/68', '127/82/69'
+  ]
+  data = parse_regex(lines)
+  data[1].note = 'after walk'
+  store = Store(':memory:', create=True)
+  # ### ingest (in batches), ``None`` values are skipped:
+  assert_equal(store.ingest(data + [None], batch=2), len(data))
+  assert_equal(len(store), len(data))
+  assert_equal(store.ingest([]), 0)
+  # ### select:
+  res = store.select()
+  assert_equal([m.as_tuple() for m in res], [m.as_tuple() for m in data])
+  assert_equal(res[1].note, 'after walk')
+  assert_equal(res[1].time, '20:00')
+  criteria = Criteria('2013-01-01', '2013-01-31', sys=(None, 125))
+  assert_equal([m.sys for m in store.select(criteria)], [123, 125])
+  assert_equal([m.sys for m in store.select(criteria, limit=1)], [123])
+  # ### aggregates need to match the ones from ``Statistic``:
+  assert_partial_equal(store.partial(), Statistic(data).as_partial())
+  assert_partial_equal(store.partial(criteria), Statistic(
+    parse_regex(lines, criteria=Criteria('2013-01-01', '2013-01-31', sys=(None, 125)))
+  ).as_partial())
+  buckets = store.buckets('month')
+  assert_equal([b['period'] for b in buckets], ['2013-01', '2013-02'])
+  assert_equal([b['count'] for b in buckets], [3, 1])
+  assert_equal(
+    (buckets[0]['sys_min'], buckets[0]['sys_max'], buckets[0]['sys_avg']),
+    (123, 131, 126)
+  )
+  assert_equal(len(store.buckets('day', criteria)), 2)
+  # ### readings the database doesn't select are counted as rejected:
+  criteria = Criteria(sys=(None, 125))
+  assert_equal(store.count(criteria), 2)
+  fd, filename = tempfile.mkstemp()
+  os.close(fd)
+  try:
+    Store(filename, create=True).ingest(data)
+    assert_equal(len(parse_sqlite([], [filename], criteria=criteria)), 2)
+    assert_equal(criteria.rejected, 3)
+  finally:
+    os.remove(filename)
+  # ### the timestamps of the parser are stored as strings and integers:
+  timestamps = Timestamps()
+  data = parse_regex(lines, timestamps=timestamps)
+  store = Store(':memory:', create=True)
+  store.ingest(data, timestamps=timestamps)
+  assert_equal(
+    [
+      (getattr(m, 'date', None), getattr(m, 'time', None))
+      for m in store.select()
+    ],
+    [
+      ('2013-01-01', '08:00'), ('2013-01-01', '20:00'), ('2013-01-02', '08:00'),
+      ('2013-02-01', None), (None, None)
+    ]
+  )
+  assert_equal(store.buckets('month'), buckets)
+  # ### with *keys* readings already stored are ignored, across ingests:
+  keys = ('date', 'time', 'sys', 'dia', 'pulse')
+  store = Store(':memory:', create=True)
+  assert_equal(store.ingest(data[:3], timestamps=timestamps, keys=keys), 3)
+  assert_equal(store.ingest(data, timestamps=timestamps, keys=keys), 2)
+  assert_equal(len(store), len(data))
+  # ### only a database created by ``ingest`` can be read:
+  with assert_raises(BpdiagError):
+    Store(':memory:')
+
+
+def test_provenance():
+  files = (
+    ['123/78/65', 'xxx', '', '123/78/65'],
+    ['124/79/66, 125/80/67']
+  )
+  filenames = []
+  try:
+    for lines in files:
+      fd, filename = tempfile.mkstemp()
+      with os.fdopen(fd, 'w') as fh:
+        fh.write('\n'.join(lines))
+      filenames.append(filename)
+    # ### each parser records the position of each entry:
+    for parser, exp in (
+      (parse_plaintext, [(0, 1), (0, 4), (1, 1), (1, 1)]),
+      (parse_regex, [(0, 1), (0, 2), (0, 4), (1, 1)]),
+    ):
+      position = InputPosition()
+      provenance = Provenance(filenames, position)
+      data = parser(
+        read_files(filenames, position), check=None, provenance=provenance
+      )
+      assert_equal(len(provenance), len(data))
+      assert_equal(zip(provenance.files, provenance.lines), exp)
+    # + dropped repeats aren't recorded:
+    position = InputPosition()
+    provenance = Provenance(filenames, position)
+    repeats = Repeats(('sys', ))
+    data = parse_regex(
+      read_files(filenames, position), check=None, repeats=repeats,
+      provenance=provenance
+    )
+    assert_equal(repeats.dropped, 1)
+    assert_equal(
+      zip(provenance.files, provenance.lines), [(0, 1), (0, 2), (1, 1)]
+    )
+    assert_equal(provenance.location(2), filenames[1] + ':1')
+  finally:
+    for filename in filenames:
+      os.remove(filename)
+  # ### unknown positions:
+  provenance = Provenance()
+  parse_plaintext(['123/78/65'], provenance=provenance)
+  assert_equal(provenance.location(0), '<input>')
+  assert_equal(provenance.filename(0), None)
+
+
+def test_groups():
+  lines = [
+    '2013-01-23 123/78/65', '2013-01-23 131/82/71', 'xxx', '2013-01-24 118/76/60'
+  ]
+  position = InputPosition()
+  provenance = Provenance(['a.txt'], position)
+  position.file = 0
+  data = []
+  for position.line, line in enumerate(lines, 1):
+    data.extend(parse_regex([line], check=None, provenance=provenance))
+  stats = Statistic(data)
+  # ### by attribute (``None`` values are left out):
+  stats.evaluate_groups('date')
+  assert_equal(stats.groups.keys(), ['2013-01-23', '2013-01-24'])
+  group = stats.groups['2013-01-23']
+  assert_equal((group['count'], group['skipped']), (2, 0))
+  assert_equal(
+    (group['sys_min'], group['sys_max'], group['sys_avg']), (123, 131, 127)
+  )
+  assert_equal(stats.groups['2013-01-24']['pulse_avg'], 60)
+  # + missing attributes are grouped under ``None``:
+  stats.evaluate_groups('flag')
+  assert_equal(stats.groups.keys(), [None])
+  assert_equal(stats.groups[None]['count'], 3)
+  # ### by position:
+  stats.evaluate_groups('file', provenance)
+  assert_equal(stats.groups.keys(), ['a.txt'])
+  assert_equal(
+    (stats.groups['a.txt']['count'], stats.groups['a.txt']['skipped']), (3, 1)
+  )
+  stats.evaluate_groups('line', provenance)
+  assert_equal(
+    stats.groups.keys(), ['a.txt:1', 'a.txt:2', 'a.txt:3', 'a.txt:4']
+  )
+  assert_equal(stats.groups['a.txt:3']['sys_min'], None)
+  assert_raises(BpdiagError, stats.evaluate_groups, 'file')
+  # + aligned data is grouped by line without provenance:
+  stats = Statistic(parse_plaintext(
+    ['123/78/65, 131/82/71', '118/76/60, -'], align_lines=True
+  ))
+  stats.evaluate_groups('line')
+  assert_equal(stats.groups.keys(), [1, 2])
+  assert_equal(
+    (stats.groups[1]['count'], stats.groups[1]['dia_max']), (2, 82)
+  )
+  assert_equal(
+    (stats.groups[2]['count'], stats.groups[2]['skipped']), (1, 1)
+  )
+
+
+def test_read_files():
+  tmp = tempfile.mkdtemp()
+  try:
+    os.makedirs(os.path.join(tmp, 'sub', 'subsub'))
+    os.makedirs(os.path.join(tmp, 'sub', '.git'))
+    os.makedirs(os.path.join(tmp, 'empty'))
+    names = (
+      '2013-01-02.txt', '2013-01-01.txt', 'notes.md',
+      os.path.join('sub', 'a.txt'), os.path.join('sub', 'subsub', 'b.txt'),
+      '.hidden.txt', os.path.join('sub', '.git', 'c.txt')
+    )
+    for i, name in enumerate(names):
+      with open(os.path.join(tmp, name), 'w') as fh:
+        fh.write(''.join('{}-{}\n'.format(name, n) for n in range(i + 1)))
+    path = lambda *names: [os.path.join(tmp, name) for name in names]
+    # ### expand directories and glob patterns (without hidden files):
+    assert_equal(
+      expand_filenames([tmp]), path('2013-01-01.txt', '2013-01-02.txt', 'notes.md')
+    )
+    assert_equal(
+      expand_filenames([os.path.join(tmp, 'sub')], recursive=True),
+      path(os.path.join('sub', 'a.txt'), os.path.join('sub', 'subsub', 'b.txt'))
+    )
+    assert_equal(
+      expand_filenames([os.path.join(tmp, '*.txt'), 'missing']),
+      path('2013-01-01.txt', '2013-01-02.txt') + ['missing']
+    )
+    # + patterns and directories without files are kept out:
+    assert_equal(
+      expand_filenames([os.path.join(tmp, '*.csv'), os.path.join(tmp, 'empty')]),
+      []
+    )
+    # ### prefetching keeps the order (and skips unreadable files):
+    filenames = expand_filenames([tmp], recursive=True) * 20
+    filenames.insert(7, os.path.join(tmp, 'missing'))
+    exp = list(read_files(filenames))
+    assert_equal(len(exp), 15 * 20)
+    for prefetch in (1, 4):
+      position = InputPosition()
+      res = []
+      for line in read_files(filenames, position, prefetch):
+        res.append(line)
+        assert line.startswith(os.path.relpath(
+          filenames[position.file], tmp
+        ))
+      assert_equal(res, exp)
+    # + and stops early, if the lines aren't needed:
+    lines = read_files(filenames, prefetch=2)
+    assert_equal(next(lines), exp[0])
+    lines.close()
+  finally:
+    shutil.rmtree(tmp)
+
+
+def test_head_and_sample():
+  lines = ['{}/80/{}'.format(100 + i, 60 + i % 2) for i in range(100)]
+  # ### ``head`` stops reading as soon as enough readings are stored:
+  for parser in (parse_plaintext, parse_regex):
+    source = iter(lines)
+    data = parser(source, head=3)
+    assert_equal([m.sys for m in data], [100, 101, 102])
+    assert_equal(next(source), lines[3])
+  # + ``None`` values don't count:
+  data = parse_csv(
+    ['sys,dia,pulse', '1,2,3', 'x,2,3', '4,5,6', '7,8,9'], check=None, head=2
+  )
+  assert_equal([m and m.sys for m in data], [1, None, 4])
+  data = parse_regex(
+    ['xxx', '120/80/60', 'yyy', '121/80/60', '122/80/60'], check=None, head=2
+  )
+  assert_equal([m and m.sys for m in data], [None, 120, None, 121])
+  data = parse_plaintext(['-, 1/2/3, -', '-, 4/5/6, -', '7/8/9'], head=2)
+  assert_equal([m and m.sys for m in data], [None, 1, None, None, 4])
+  data = parse_plaintext(['1/2/3, 4/5/6', '7/8/9'], head=1, align_lines=True)
+  assert_equal([[m.sys for m in line] for line in data], [[1]])
+  assert_equal(len(parse_json('[[1, 2, 3], [4, 5, 6]]', head=1)), 1)
+  # ### ``sample`` keeps a uniform sample of fixed size:
+  provenance = Provenance()
+  sample = Reservoir(10, seed=1, provenance=provenance)
+  data = parse_regex(
+    ('{} {}'.format(i, line) for i, line in enumerate(lines)), sample=sample,
+    regex=r'(?P<index>\d+) (?P<sys>\d+)/(?P<dia>\d+)/(?P<pulse>\d+)'
+  )
+  assert_equal((len(data), sample.seen, len(provenance)), (10, 100, 10))
+  assert_equal(len(set(m.sys for m in data)), 10)
+  for m in data:
+    assert_equal(m.sys, 100 + int(m.index))
+  # + the same seed results in the same sample:
+  assert_equal(
+    [m.sys for m in parse_plaintext(lines, sample=Reservoir(10, seed=1))],
+    [m.sys for m in data]
+  )
+  # + each entry has the same chance to end up in it:
+  counts = [0] * 10
+  for seed in range(1000):
+    sample = Reservoir(2, seed)
+    sample.extend(range(10))
+    for value in sample.values:
+      counts[value] += 1
+  assert min(counts) > 150 and max(counts) < 250, counts
+  # + less entries than *size* are all kept (in order):
+  assert_equal(parse_json('[[1, 2, 3]]', sample=Reservoir(5))[0].sys, 1)
+  assert_raises(
+    BpdiagError, parse_plaintext, lines, align_lines=True, sample=Reservoir(5)
+  )
+  # + ``None`` values aren't offered to it:
+  dirty = ['xxx', '120/80/60', '-', '121/80/60']
+  for parser, source in (
+    (parse_plaintext, dirty), (parse_regex, dirty),
+    (parse_csv, ['sys,dia,pulse', '120,80,60', 'x,2,3', '121,80,60'])
+  ):
+    sample = Reservoir(5)
+    data = parser(source, check=None, sample=sample)
+    assert_equal(([m.sys for m in data], sample.seen), ([120, 121], 2))
+
+
+def test_exporter():
+  data = parse_plaintext(
+    ['123/78/65, 124/79/66', '-, 125/80/67'], align_lines=True
+  )
+  stats = Statistic(data)
+  provenance = Provenance(['a.txt'])
+  provenance.files.extend([0] * 4)
+  provenance.lines.extend([1, 1, 2, 2])
+  tmp = tempfile.mkdtemp()
+  try:
+    path = lambda name: os.path.join(tmp, name)
+    exporter = Exporter(stats, provenance, separators=(',', ':'))
+    for kind in ('json', 'json-obj', 'json-stats', 'json-partial'):
+      exporter.add_json(kind, path(kind))
+    exporter.add_task(lambda a, b: a + b, 1, 2)
+    assert_equal(exporter.run(), [
+      path('json'), path('json-obj'), path('json-stats'), path('json-partial'),
+      3
+    ])
+    load = lambda name: json.load(open(path(name)))
+    # ### the dumps keep the lines aligned:
+    assert_equal(
+      load('json'), [[[123, 78, 65], [124, 79, 66]], [None, [125, 80, 67]]]
+    )
+    objects = load('json-obj')
+    assert_equal(objects[1][0], None)
+    assert_equal(
+      objects[1][1],
+      {'sys': 125, 'dia': 80, 'pulse': 67, 'file': 'a.txt', 'line': 2}
+    )
+    # + provenance is only added to the *json-obj* dump:
+    stats_dump = load('json-stats')
+    assert_equal(stats_dump['data'][3], {'sys': 125, 'dia': 80, 'pulse': 67})
+    assert_equal(stats_dump['sys'], [123, 124, None, 125])
+    assert_equal(load('json-partial')['count'], 4)
+    # ### only the requested dumps are converted:
+    exporter = Exporter(stats, provenance)
+    exporter.add_json('json')
+    assert_equal(exporter.convert().keys(), ['json'])
+    exporter = Exporter(stats, provenance)
+    exporter.add_json('json-stats')
+    documents = exporter.convert()
+    assert_equal(documents.keys(), ['json-stats'])
+    assert_equal(documents['json-stats']['data'], stats_dump['data'])
+    # + readings with own *file* or *line* attributes aren't overwritten:
+    data.values[0].line = 7
+    exporter = Exporter(stats, provenance)
+    exporter.add_json('json-obj')
+    assert_raises(BpdiagError, exporter.convert)
+    del data.values[0].line
+    # ### errors in any output are raised:
+    exporter = Exporter(stats)
+    exporter.add_json('json', path('missing/json'))
+    assert_raises(IOError, exporter.run)
+    assert_raises(BpdiagError, exporter.add_json, 'xml')
+    assert_equal(Exporter(stats).run(), [])
+  finally:
+    shutil.rmtree(tmp)